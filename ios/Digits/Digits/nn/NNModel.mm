@@ -39,12 +39,14 @@
 @implementation NNModel
 
 - (void)loadModel:(NSString *)filename ready:(void (^)())ready {
-    self.modelPath = [[NSBundle mainBundle] pathForResource:filename ofType:@"model.gz"];
+    // Prefer the binary format (see python/modelio.py), which skips decompressing and parsing weights:
+    NSString* binaryPath = [[NSBundle mainBundle] pathForResource:filename ofType:@"model.bin"];
+    self.modelPath = binaryPath ?: [[NSBundle mainBundle] pathForResource:filename ofType:@"model.gz"];
     const char* path = [self.modelPath cStringUsingEncoding:NSUTF8StringEncoding];
     
     dispatch_async(dispatch_get_global_queue(DISPATCH_QUEUE_PRIORITY_HIGH, 0), ^{
-        // What takes the most time in loading a model is the string => json convertion...
-        self->model = nn::importModel(path);
+        // What takes the most time in loading a gzipped model is the string => json convertion...
+        self->model = binaryPath ? nn::importBinaryModel(path) : nn::importModel(path);
         self.ready = YES;
         
         dispatch_async(dispatch_get_main_queue(), ready);
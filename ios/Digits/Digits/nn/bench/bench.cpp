@@ -0,0 +1,160 @@
+//The MIT License (MIT)
+//
+//Copyright (c) 2018 Federico Saldarini
+//https://www.linkedin.com/in/federicosaldarini
+//https://github.com/saldavonschwartz
+//https://0xfede.io
+//
+//Permission is hereby granted, free of charge, to any person obtaining a copy
+//of this software and associated documentation files (the "Software"), to deal
+//in the Software without restriction, including without limitation the rights
+//to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+//copies of the Software, and to permit persons to whom the Software is
+//furnished to do so, subject to the following conditions:
+//
+//The above copyright notice and this permission notice shall be included in all
+//copies or substantial portions of the Software.
+//
+//THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+//IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+//FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+//AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+//LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+//OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+//SOFTWARE.
+
+// Command line harness for the C++ inference core: load and inference timings of Net vs FastNet
+// and, given reference inputs and outputs written by python (see modelio.writeReference), output parity.
+// Net's Add only broadcasts over a single example, so it evaluates batches one example at a time.
+//
+// usage: bench <model.gz> [<inputs.npy> <outputs.npy>] [--repeat n]
+
+#include <iostream>
+#include <sstream>
+#include <fstream>
+#include <random>
+#include "nn.hpp"
+#include "fast.hpp"
+
+using clock_ = std::chrono::steady_clock;
+
+template <class F>
+double best(int repeat, F f) {
+    double best = 1e300;
+    
+    for (int i = 0; i < repeat; i++) {
+        auto t = clock_::now();
+        f();
+        best = std::min(best, std::chrono::duration<double>(clock_::now() - t).count());
+    }
+    
+    return best;
+}
+
+// A 2d little-endian float32, C order .npy array (as written by np.save):
+nn::ndarray loadNpy(const char* filename) {
+    std::ifstream file(filename, std::ios::binary);
+    char magic[8];
+    
+    if (!file.read(magic, 8) || std::memcmp(magic, "\x93NUMPY", 6)) {
+        throw std::runtime_error(std::string("not a .npy file: ") + filename);
+    }
+    
+    uint32_t headerSize = 0;
+    file.read(reinterpret_cast<char*>(&headerSize), magic[6] == 1 ? 2 : 4);
+    std::string header(headerSize, ' ');
+    file.read(&header[0], headerSize);
+    
+    long rows = 0, cols = 0;
+    auto shape = header.find("'shape': (");
+    
+    if (header.find("'descr': '<f4'") == std::string::npos || header.find("'fortran_order': False") == std::string::npos ||
+        shape == std::string::npos || std::sscanf(header.c_str() + shape, "'shape': (%ld, %ld)", &rows, &cols) != 2) {
+        throw std::runtime_error(std::string("expected a 2d float32 array: ") + filename);
+    }
+    
+    using rowMajor = Eigen::Matrix<float, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor>;
+    rowMajor data(rows, cols);
+    file.read(reinterpret_cast<char*>(data.data()), rows * cols * sizeof(float));
+    return data;
+}
+
+// Evaluate a batch with Net, one example at a time:
+nn::ndarray evalNet(nn::Net& net, const nn::ndarray& x) {
+    nn::ndarray out;
+    
+    for (long i = 0; i < x.rows(); i++) {
+        nn::ndarray y = net(nn::NetVar(nn::ndarray(x.row(i))));
+        out.conservativeResize(x.rows(), y.cols());
+        out.row(i) = y;
+    }
+    
+    return out;
+}
+
+int main(int argc, const char* argv[]) {
+    std::vector<const char*> paths;
+    int repeat = 50;
+    
+    for (int i = 1; i < argc; i++) {
+        if (std::string(argv[i]) == "--repeat" && i + 1 < argc) {
+            repeat = std::atoi(argv[++i]);
+        }
+        else {
+            paths.push_back(argv[i]);
+        }
+    }
+    
+    if (paths.size() != 1 && paths.size() != 3) {
+        std::cerr << "usage: bench <model.gz> [<inputs.npy> <outputs.npy>] [--repeat n]\n";
+        return 2;
+    }
+    
+    // Loading (importModel profiles itself to stdout, which is silenced while timing it):
+    nn::Net net;
+    nn::FastNet fast;
+    std::ostringstream silenced;
+    auto out = std::cout.rdbuf(silenced.rdbuf());
+    auto loadNet = best(3, [&]() { net = nn::importModel(paths[0]); });
+    std::cout.rdbuf(out);
+    auto loadFast = best(3, [&]() { fast = nn::importModelFast(paths[0]); });
+    
+    std::printf("load: Net: %.4f sec. | FastNet: %.4f sec. | speedup: %.2fx\n", loadNet, loadFast, loadNet / loadFast);
+    
+    int status = 0;
+    
+    // Parity against the reference outputs of nn.FFN, and between both C++ paths:
+    if (paths.size() == 3) {
+        nn::ndarray x = loadNpy(paths[1]), expected = loadNpy(paths[2]);
+        nn::ndarray a = evalNet(net, x), b = fast(x);
+        
+        long agree = 0;
+        
+        for (long i = 0; i < x.rows(); i++) {
+            long pe, pb;
+            expected.row(i).maxCoeff(&pe);
+            b.row(i).maxCoeff(&pb);
+            agree += pe == pb;
+        }
+        
+        float netError = (a - expected).cwiseAbs().maxCoeff(), fastError = (b - expected).cwiseAbs().maxCoeff();
+        status = fastError > 1e-4f || agree != x.rows();
+        std::printf("parity (%ld examples): max |Net - nn.FFN|: %.3g | max |FastNet - nn.FFN|: %.3g | same predictions: %ld | %s\n",
+                    (long)x.rows(), netError, fastError, agree, status ? "FAIL" : "OK");
+    }
+    
+    // Inference:
+    std::mt19937 random(0);
+    std::uniform_real_distribution<float> uniform(0, 1);
+    
+    for (long n : {1, 16, 64, 256, 1024}) {
+        nn::ndarray x = nn::ndarray::NullaryExpr(n, 28 * 28, [&]() { return uniform(random); });
+        fast.reserve(n);
+        auto netTime = best(repeat, [&]() { evalNet(net, x); });
+        auto fastTime = best(repeat, [&]() { fast(x); });
+        
+        std::printf("b%ld: Net: %.6f sec. | FastNet: %.6f sec. | speedup: %.2fx\n", n, netTime, fastTime, netTime / fastTime);
+    }
+    
+    return status;
+}
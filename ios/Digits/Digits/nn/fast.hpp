@@ -0,0 +1,394 @@
+//The MIT License (MIT)
+//
+//Copyright (c) 2018 Federico Saldarini
+//https://www.linkedin.com/in/federicosaldarini
+//https://github.com/saldavonschwartz
+//https://0xfede.io
+//
+//Permission is hereby granted, free of charge, to any person obtaining a copy
+//of this software and associated documentation files (the "Software"), to deal
+//in the Software without restriction, including without limitation the rights
+//to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+//copies of the Software, and to permit persons to whom the Software is
+//furnished to do so, subject to the following conditions:
+//
+//The above copyright notice and this permission notice shall be included in all
+//copies or substantial portions of the Software.
+//
+//THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+//IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+//FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+//AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+//LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+//OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+//SOFTWARE.
+
+#ifndef fast_hpp
+#define fast_hpp
+
+#include <zlib.h>
+#include <algorithm>
+#include <cstdio>
+#include <cstdlib>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#include "nn.hpp"
+
+#if __cplusplus >= 201703L && defined(__has_include)
+#if __has_include(<charconv>)
+#include <charconv>
+#endif
+#endif
+
+namespace nn {
+    
+    // Inference only version of Net: each Multiply + Add (+ ReLU) sequence is fused into a single affine layer,
+    // and activations are written into buffers allocated once for up to a number of examples, instead of
+    // a fresh NetVar / NetOp per layer and call.
+    struct FastNet {
+        struct Affine {
+            ndarray w;
+            Eigen::RowVectorXf b;
+            bool relu;
+        };
+        
+        vector<Affine> layers;
+        bool softmax = false;
+        vector<ndarray> buffers;
+        Eigen::VectorXf rowScratch;
+        
+        // Allocate buffers for batches of up to maxBatch examples (larger batches grow them):
+        void reserve(long maxBatch) {
+            buffers.resize(layers.size());
+            
+            for (size_t i = 0; i < layers.size(); i++) {
+                buffers[i].resize(maxBatch, layers[i].w.cols());
+            }
+            
+            rowScratch.resize(maxBatch);
+        }
+        
+        // The output is a view of an internal buffer, overwritten by the next call:
+        Eigen::Block<ndarray> operator()(const Eigen::Ref<const ndarray>& x) {
+            const long n = x.rows();
+            
+            if (layers.empty()) {
+                throw std::runtime_error("empty model");
+            }
+            
+            if (buffers.size() != layers.size() || buffers[0].rows() < n) {
+                reserve(n);
+            }
+            
+            for (size_t i = 0; i < layers.size(); i++) {
+                auto& layer = layers[i];
+                auto out = buffers[i].topRows(n);
+                
+                if (i) {
+                    out.noalias() = buffers[i - 1].topRows(n) * layer.w;
+                }
+                else {
+                    out.noalias() = x * layer.w;
+                }
+                
+                out.rowwise() += layer.b;
+                
+                if (layer.relu) {
+                    out = out.cwiseMax(0);
+                }
+            }
+            
+            auto out = buffers.back().topRows(n);
+            
+            if (softmax) {
+                auto scratch = rowScratch.head(n);
+                scratch = out.rowwise().maxCoeff();
+                out.colwise() -= scratch;
+                out = out.array().exp().matrix();
+                scratch = out.rowwise().sum();
+                out.array().colwise() /= scratch.array();
+            }
+            
+            return out;
+        }
+    };
+    
+    // Read a whole gzip file in one pass, sized by its trailer (the uncompressed size mod 2^32):
+    inline std::vector<char> readGzip(const char* filename) {
+        FILE* raw = std::fopen(filename, "rb");
+        
+        if (!raw) {
+            throw std::runtime_error(std::string("can't open ") + filename);
+        }
+        
+        unsigned char trailer[4] = {0, 0, 0, 0};
+        
+        if (!std::fseek(raw, -4, SEEK_END)) {
+            std::fread(trailer, 1, 4, raw);
+        }
+        
+        std::fclose(raw);
+        
+        size_t size = 0, capacity = (size_t)trailer[0] | (size_t)trailer[1] << 8 | (size_t)trailer[2] << 16 |
+            (size_t)trailer[3] << 24;
+        std::vector<char> data(capacity + 1);
+        gzFile file = gzopen(filename, "rb");
+        
+        if (!file) {
+            throw std::runtime_error(std::string("can't open ") + filename);
+        }
+        
+        gzbuffer(file, 1 << 20);
+        
+        while (true) {
+            // Reads are capped by gzread's int return value:
+            unsigned chunk = (unsigned)std::min(data.size() - size, (size_t)1 << 30);
+            int n = gzread(file, data.data() + size, chunk);
+            
+            if (n < 0) {
+                gzclose(file);
+                throw std::runtime_error(std::string("can't decompress ") + filename);
+            }
+            
+            size += n;
+            
+            if ((unsigned)n < chunk) {
+                break;
+            }
+            
+            // The trailer was off (files over 4GB or concatenated streams):
+            if (size == data.size()) {
+                data.resize(data.size() * 2);
+            }
+        }
+        
+        gzclose(file);
+        data.resize(size);
+        return data;
+    }
+    
+    // A parser for the json nnkit saves models as ([{"op": name, "args": [...]}, ...]), which reads weights
+    // straight into Eigen matrices instead of building a json document and nested vectors first:
+    struct ModelParser {
+        const char* p;
+        const char* end;
+        vector<float> values;
+        
+        ModelParser(const char* begin, const char* end) : p(begin), end(end) {}
+        
+        void fail(const char* what) {
+            throw std::runtime_error(std::string("model json: ") + what);
+        }
+        
+        char peek() {
+            while (p < end && (*p == ' ' || *p == '\n' || *p == '\r' || *p == '\t')) {
+                p++;
+            }
+            
+            return p < end ? *p : '\0';
+        }
+        
+        void expect(char c) {
+            if (peek() != c) {
+                fail("unexpected character");
+            }
+            
+            p++;
+        }
+        
+        // Whether the next character is c, consuming it if so:
+        bool accept(char c) {
+            if (peek() != c) {
+                return false;
+            }
+            
+            p++;
+            return true;
+        }
+        
+        std::string string() {
+            expect('"');
+            auto start = p;
+            
+            while (p < end && *p != '"') {
+                p += *p == '\\' ? 2 : 1;
+            }
+            
+            if (p >= end) {
+                fail("unterminated string");
+            }
+            
+            return std::string(start, p++);
+        }
+        
+        // Numbers are parsed as doubles and then rounded, like numpy does converting python floats to float32:
+        float number() {
+            peek();
+            double value = 0;
+#if defined(__cpp_lib_to_chars) && __cpp_lib_to_chars >= 201611L
+            auto result = std::from_chars(p, end, value);
+            
+            if (result.ec != std::errc()) {
+                fail("bad number");
+            }
+            
+            p = result.ptr;
+#else
+            char* next = nullptr;
+            value = std::strtod(p, &next);
+            
+            if (next == p) {
+                fail("bad number");
+            }
+            
+            p = next;
+#endif
+            return (float)value;
+        }
+        
+        // A 1 or 2 dimensional list of numbers, as a matrix (1 dimensional lists are a single row):
+        ndarray matrix() {
+            long rows = 0;
+            values.clear();
+            expect('[');
+            
+            // The rest of a row, after its '[':
+            auto row = [this]() {
+                if (!accept(']')) {
+                    do {
+                        values.push_back(number());
+                    } while (accept(','));
+                    
+                    expect(']');
+                }
+            };
+            
+            if (peek() == '[') {
+                do {
+                    expect('[');
+                    row();
+                    rows++;
+                } while (accept(','));
+                
+                expect(']');
+            }
+            else {
+                row();
+                rows = 1;
+            }
+            
+            long cols = rows ? (long)values.size() / rows : 0;
+            
+            if (cols * rows != (long)values.size()) {
+                fail("ragged array");
+            }
+            
+            using rowMajor = Eigen::Matrix<float, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor>;
+            return ndarray(Eigen::Map<const rowMajor>(values.data(), rows, cols));
+        }
+        
+        // Skip any json value (i.e.: arguments which aren't arrays):
+        void skip() {
+            int depth = 0;
+            
+            do {
+                char c = peek();
+                
+                if (c == '"') {
+                    string();
+                    continue;
+                }
+                
+                if (c == '\0') {
+                    fail("unexpected end");
+                }
+                
+                depth += (c == '[' || c == '{') - (c == ']' || c == '}');
+                p++;
+            } while (depth > 0 || (peek() != ',' && peek() != ']' && peek() != '}'));
+        }
+        
+        FastNet net() {
+            FastNet net;
+            bool fusable = false;
+            expect('[');
+            
+            if (accept(']')) {
+                return net;
+            }
+            
+            do {
+                std::string op;
+                vector<ndarray> args;
+                expect('{');
+                
+                do {
+                    auto key = string();
+                    expect(':');
+                    
+                    if (key == "op") {
+                        op = string();
+                    }
+                    else if (key == "args") {
+                        expect('[');
+                        
+                        if (!accept(']')) {
+                            do {
+                                if (peek() == '[') {
+                                    args.push_back(matrix());
+                                }
+                                else {
+                                    skip();
+                                }
+                            } while (accept(','));
+                            
+                            expect(']');
+                        }
+                    }
+                    else {
+                        skip();
+                    }
+                } while (accept(','));
+                
+                expect('}');
+                
+                if (net.softmax) {
+                    fail("SoftMax must be the last op");
+                }
+                
+                if (op == "Multiply" && args.size() == 1) {
+                    net.layers.push_back({args[0], Eigen::RowVectorXf::Zero(args[0].cols()), false});
+                    fusable = true;
+                }
+                else if (op == "Add" && args.size() == 1 && fusable && args[0].rows() == 1 &&
+                         args[0].cols() == net.layers.back().w.cols()) {
+                    net.layers.back().b += args[0].row(0);
+                }
+                else if (op == "ReLU" && fusable) {
+                    net.layers.back().relu = true;
+                    fusable = false;
+                }
+                else if (op == "SoftMax" || op == "Softmax") {
+                    net.softmax = true;
+                }
+                else {
+                    fail(("unsupported op for fusion: " + op).c_str());
+                }
+            } while (accept(','));
+            
+            expect(']');
+            return net;
+        }
+    };
+    
+    // Load a '.model.gz' into a FastNet: bulk decompression, then direct parsing of weights into Eigen.
+    inline FastNet importModelFast(const char* filename, long maxBatch = 1) {
+        auto data = readGzip(filename);
+        auto net = ModelParser(data.data(), data.data() + data.size()).net();
+        net.reserve(maxBatch);
+        return net;
+    }
+}
+
+#endif /* fast_hpp */
@@ -28,6 +28,8 @@
 
 #include <zlib.h>
 #include <string>
+#include <fstream>
+#include <cstring>
 #include "3rdparty/json.hpp"
 #include "nn.hpp"
 #include <chrono>
@@ -74,6 +76,9 @@ namespace nn {
                 PROFILE_BLOCK("zip >> memory\t");
                 while(gzgets(file, buffer, bufferSize))
                     data += buffer;
+                
+                gzclose(file);
+                delete[] buffer;
             }
             
             jsn json;
@@ -102,7 +107,81 @@ namespace nn {
                     else if (opType == "ReLU") {
                         topology.push_back(nn::Layer<nn::ReLU>());
                     }
-                    else if (opType == "SoftMax") {
+                    else if (opType == "Softmax" || opType == "SoftMax") {
+                        topology.push_back(nn::Layer<nn::SoftMax>());
+                    }
+                }
+            }
+            
+            return nn::Net(topology);
+        }
+    }
+    
+    // Binary container written by python/modelio.py: magic, version, json header with
+    // the shape and file offset of each weight block, then raw little-endian float32 blocks.
+    Net importBinaryModel(const char* filename) {
+        std::cout << "\n---- importing binary model -----\n" << filename << "\n";
+        {
+            PROFILE_BLOCK("---- done -----");
+            
+            std::vector<char> data;
+            
+            {
+                PROFILE_BLOCK("file >> memory\t");
+                std::ifstream file(filename, std::ios::binary | std::ios::ate);
+                data.resize(file.tellg());
+                file.seekg(0);
+                file.read(data.data(), data.size());
+            }
+            
+            const char magic[] = "NNKITBIN";
+            uint32_t version = 0, headerSize = 0;
+            
+            if (data.size() < 16 || std::memcmp(data.data(), magic, 8)) {
+                throw std::runtime_error("not a binary model file");
+            }
+            
+            std::memcpy(&version, data.data() + 8, 4);
+            std::memcpy(&headerSize, data.data() + 12, 4);
+            
+            if (version != 1) {
+                throw std::runtime_error("unsupported binary model version");
+            }
+            
+            jsn json;
+            
+            {
+                PROFILE_BLOCK("header >> json\t");
+                json = jsn::parse(data.begin() + 16, data.begin() + 16 + headerSize);
+            }
+            
+            std::vector<nn::LayerBase> topology;
+            
+            {
+                PROFILE_BLOCK("blocks >> net\t\t");
+                using rowMajor = Eigen::Matrix<float, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor>;
+                
+                auto block = [&data](const jsn& arg) {
+                    auto shape = arg["shape"].get<std::vector<long>>();
+                    auto rows = shape.size() > 1 ? shape[0] : 1;
+                    auto cols = shape.back();
+                    auto p = reinterpret_cast<const float*>(data.data() + arg["offset"].get<size_t>());
+                    return NetVar(ndarray(Eigen::Map<const rowMajor>(p, rows, cols)));
+                };
+                
+                for (auto& node : json) {
+                    auto opType = node["op"].get<std::string>();
+                    
+                    if (opType == "Multiply") {
+                        topology.push_back(nn::Layer<nn::Multiply>(block(node["args"][0])));
+                    }
+                    else if (opType == "Add") {
+                        topology.push_back(nn::Layer<nn::Add>(block(node["args"][0])));
+                    }
+                    else if (opType == "ReLU") {
+                        topology.push_back(nn::Layer<nn::ReLU>());
+                    }
+                    else if (opType == "Softmax" || opType == "SoftMax") {
                         topology.push_back(nn::Layer<nn::SoftMax>());
                     }
                 }
@@ -0,0 +1,165 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import nnkit as nn
+import numpy as np
+import zlib
+import time
+
+import training
+
+
+class Augmentation:
+    """Random affine transforms (shift, rotation, scale) and stroke dilation of whole batches of 28x28 images.
+
+    Pass an instance as a dataset.Minibatches transform (or trainMNIST's augmentation). Batches are augmented
+    where they are gathered, so with prefetch they are augmented in the background thread while the previous batch
+    trains. The random parameters of a batch are drawn from a generator seeded by the augmentation's seed and the
+    indices of the examples in the batch, so they only depend on which examples were drawn (which numpy's global,
+    seedable generator decides) and not on timing, threads or processes.
+
+    Attributes:
+    . seed, shift, rotate, scale, dilate: see __init__.
+    . samples: the number of examples augmented so far.
+    . seconds: the time spent augmenting them.
+    """
+    def __init__(self, seed=0, shift=2., rotate=15., scale=(0.9, 1.1), dilate=0.3, size=28):
+        """
+        :param seed: seed of the augmentation's random generators.
+
+        :param shift: the largest shift in pixels, along each axis.
+
+        :param rotate: the largest rotation in degrees, either way.
+
+        :param scale: the range of scale factors.
+
+        :param dilate: the probability of dilating the strokes of an image (3x3 max filter).
+
+        :param size: the width and height of images.
+        """
+        self.seed, self.shift, self.rotate, self.scale, self.dilate = seed, shift, rotate, scale, dilate
+        self.size = size
+        self.samples, self.seconds = 0, 0.
+
+        # Output pixel coordinates, relative to the center of the image:
+        center = (size - 1) / 2
+        self.center = center
+        self.coordinates = np.arange(size, dtype=nn.dtype) - center
+
+    def __call__(self, x, ids):
+        """Augment a batch in place.
+
+        :param x: a (n, size * size) batch of images.
+        :param ids: the indices of the images in their dataset.
+        """
+        t = time.perf_counter()
+        n, size = len(x), self.size
+        random = np.random.RandomState((self.seed * 1000003 + zlib.crc32(np.ascontiguousarray(ids))) % 2 ** 32)
+
+        angle = np.radians(random.uniform(-self.rotate, self.rotate, n))
+        scale = random.uniform(*self.scale, n)
+        shift = random.uniform(-self.shift, self.shift, (n, 2))
+        dilate = random.rand(n) < self.dilate
+
+        # Map output pixels back to the source images (the inverse transform), as (n, size, size) coordinates:
+        cos, sin = (np.cos(angle) / scale)[:, None, None], (np.sin(angle) / scale)[:, None, None]
+        dx = self.coordinates[None, None, :] - shift[:, 0, None, None]
+        dy = self.coordinates[None, :, None] - shift[:, 1, None, None]
+        sx = cos * dx + sin * dy + self.center
+        sy = cos * dy - sin * dx + self.center
+
+        # Bilinear interpolation from images padded with a 1 pixel border of zeros:
+        padded = np.zeros((n, size + 2, size + 2), nn.dtype)
+        padded[:, 1:-1, 1:-1] = x.reshape(n, size, size)
+        padded = padded.ravel()
+
+        x0, y0 = np.floor(sx), np.floor(sy)
+        fx, fy = (sx - x0).astype(nn.dtype), (sy - y0).astype(nn.dtype)
+        x0 = np.clip(x0.astype(np.intp) + 1, 0, size)
+        y0 = np.clip(y0.astype(np.intp) + 1, 0, size)
+        i = np.arange(n)[:, None, None] * (size + 2) ** 2 + y0 * (size + 2) + x0
+
+        # Samples outside the image read the border, which is 0:
+        outside = (sx <= -1) | (sx >= size) | (sy <= -1) | (sy >= size)
+        out = (
+            padded[i] * (1 - fx) * (1 - fy) + padded[i + 1] * fx * (1 - fy) +
+            padded[i + size + 2] * (1 - fx) * fy + padded[i + size + 3] * fx * fy
+        )
+        out[outside] = 0
+
+        if np.any(dilate):
+            out[dilate] = _dilate(out[dilate])
+
+        x[...] = out.reshape(n, -1)
+        self.samples += n
+        self.seconds += time.perf_counter() - t
+
+
+def benchmark(trainingSet, batchSize=16, layers=(300,), batches=200, augmentation=None, prefetch=1, seed=0):
+    """Compare augmentation throughput with training step throughput.
+
+    :param trainingSet: see training.trainMNIST.
+
+    :param batchSize, layers: the minibatch size and hidden layers of the model trained on.
+
+    :param batches: how many minibatches to train on.
+
+    :param augmentation: the Augmentation to measure. Defaults to Augmentation(seed).
+
+    :param prefetch: how many batches to gather (and augment) ahead in the background.
+
+    :param seed: seed for the model and minibatch order.
+
+    :return: a dictionary with samples per second of augmentation and of training steps, and the time
+    the training loop spent waiting for batches.
+    """
+    augmentation = augmentation or Augmentation(seed)
+
+    trainer = training.benchmarkTrainer(
+        layers, batchSize, trainingSet, seed, prefetch=prefetch, augmentation=augmentation
+    )
+    seconds = training.timeSteps(trainer, batches, warmup=0)
+    # Only the training steps, not waiting for batches:
+    waited = trainer.minibatches.waited
+
+    results = {
+        'augmentation': augmentation.samples / augmentation.seconds,
+        'training': batches * batchSize / (seconds - waited),
+        'waited': waited
+    }
+
+    print('augmentation: {:,.0f} samples/s | training: {:,.0f} samples/s | waited for batches: {:,.3f}s'.format(
+        *results.values()
+    ))
+
+    return results
+
+
+def _dilate(images):
+    # 3x3 max filter over a batch of images:
+    n, h, w = images.shape
+    padded = np.zeros((n, h + 2, w + 2), images.dtype)
+    padded[:, 1:-1, 1:-1] = images
+    return np.maximum.reduce([padded[:, i:i + h, j:j + w] for i in range(3) for j in range(3)])
@@ -0,0 +1,254 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import nnkit as nn
+import numpy as np
+import cv2 as cv
+import argparse
+import datetime
+import glob
+import importlib.metadata
+import json
+import os
+import platform
+import sys
+import tempfile
+
+import engine
+import modelio
+import testing
+import training
+
+"""Benchmark results file (.json):
+
+. environment: versions of python and the libraries benchmarked, platform, processor, cpu count and date.
+. config: the arguments the suite ran with.
+. results: {name: {'value': v, 'unit': u, 'better': 'higher' or 'lower'}}, one entry per measurement.
+  Names are paths like 'train/(300,)/b16' so results of different runs can be matched up.
+
+Every time is the best of several repetitions, which is the least noisy estimate of what the code costs.
+"""
+dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def syntheticMNIST(size, seed=0):
+    """Make a random dataset shaped like MNIST, so benchmarks run offline.
+
+    :param size: number of examples.
+    :param seed: seed for the examples and labels.
+
+    :return: a 2-tuple of (size, 784) float32 examples in [0, 1] with about 20% of pixels set, like MNIST digits,
+    and uint8 class indices, as in dataset.loadMNIST.
+    """
+    random = np.random.RandomState(seed)
+    examples = random.rand(size, 28 * 28).astype(nn.dtype)
+    examples[examples < 0.8] = 0
+    return examples, random.randint(0, 10, size).astype(np.uint8)
+
+
+def environment():
+    """Describe the machine and libraries benchmarks run on.
+
+    :return: a dictionary of environment metadata.
+    """
+    def version(package):
+        try:
+            return importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            return None
+
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv.__version__,
+        'nnkit': version('nnkit'),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds')
+    }
+
+
+def run(outPath=None, layers=((300,), (500, 300)), batchSizes=(16, 64, 256), inferenceBatchSizes=(1, 64, 1024),
+        imagePaths=None, resolutions=(1., 0.5, 0.25), steps=50, repeat=10, seed=0):
+    """Run the benchmark suite.
+
+    . training: optimizer steps per second, per topology and batch size (see training.Trainer).
+    . inference: latency and throughput of a forward pass per topology and batch size, plus the time
+      testing.testMNIST takes on a 10,000 example test set.
+    . preprocessing: time to find and normalize the ROIs of each image (testing.detectDigits and normalizeROIs),
+      at each resolution.
+    . model I/O: time to save a model with nn.save and to load it from each format (see modelio.loadModel).
+
+    Training and inference run on synthetic MNIST-shaped data (see syntheticMNIST).
+
+    :param outPath: optional path to write results to, as json (see above).
+
+    :param layers: the hidden layers of each topology to benchmark (see training.trainMNIST).
+
+    :param batchSizes: training batch sizes.
+
+    :param inferenceBatchSizes: inference batch sizes.
+
+    :param imagePaths: images to preprocess. Defaults to the bundled data/ images.
+
+    :param resolutions: factors to resize each image by before preprocessing it.
+
+    :param steps: how many optimizer steps to time per topology and batch size.
+
+    :param repeat: how many times to repeat every other measurement. The best time is kept.
+
+    :param seed: seed for synthetic data and model weights.
+
+    :return: a dictionary with the environment, config and results.
+    """
+    config = dict(
+        layers=[list(l) for l in layers], batchSizes=list(batchSizes), inferenceBatchSizes=list(inferenceBatchSizes),
+        imagePaths=imagePaths, resolutions=list(resolutions), steps=steps, repeat=repeat, seed=seed
+    )
+    imagePaths = sorted(glob.glob(os.path.join(dataDir, '*.*'))) if imagePaths is None else imagePaths
+    # Training steps cycle over as many epochs as they need:
+    trainingSet = syntheticMNIST(max(batchSizes) * 8, seed)
+    testSet = syntheticMNIST(10000, seed + 1)
+    results = {}
+
+    def record(name, value, unit, better):
+        results[name] = {'value': value, 'unit': unit, 'better': better}
+        print('{}: {:,.6g} {}'.format(name, value, unit))
+
+    def best(f):
+        return engine.bestTime(f, repeat)
+
+    for l in layers:
+        # Training:
+        for batchSize in batchSizes:
+            trainer = training.benchmarkTrainer(l, batchSize, trainingSet, seed)
+            seconds = training.timeSteps(trainer, steps)
+            record('train/{}/b{}'.format(l, batchSize), steps / seconds, 'steps/s', 'higher')
+
+        # Inference, without the loss node:
+        model = nn.FFN(*trainer.net.topology[:-1])
+
+        for batchSize, latency in engine.latency(model, testSet[0], inferenceBatchSizes, repeat).items():
+            record('infer/{}/b{}/latency'.format(l, batchSize), latency, 's', 'lower')
+            record('infer/{}/b{}/throughput'.format(l, batchSize), batchSize / latency, 'samples/s', 'higher')
+
+        record('infer/{}/testMNIST'.format(l), best(lambda: testing.testMNIST(model, testSet)), 's', 'lower')
+
+        # Model I/O:
+        with tempfile.TemporaryDirectory() as tempDir:
+            path = os.path.join(tempDir, 'model')
+            record('io/{}/save/gz'.format(l), best(lambda: nn.save(model.topology, path)), 's', 'lower')
+            modelio.save(model.topology, path)
+
+            for extension in ['gz', 'bin']:
+                modelPath = '{}.model.{}'.format(path, extension)
+                record('io/{}/load/{}'.format(l, extension), best(lambda: modelio.loadModel(modelPath)), 's', 'lower')
+
+    # Preprocessing:
+    context = testing.ContourContext()
+
+    def preprocess(img):
+        boxes, binary = testing.detectDigits(img, context)
+        testing.normalizeROIs(binary, boxes)
+
+    for path in imagePaths:
+        original = cv.imread(path, cv.CV_8UC4)
+
+        for factor in resolutions:
+            img = original if factor == 1 else cv.resize(original, None, fx=factor, fy=factor, interpolation=cv.INTER_AREA)
+            name = 'preprocess/{}/{}x{}'.format(os.path.basename(path), img.shape[1], img.shape[0])
+            record(name, best(lambda: preprocess(img)), 's', 'lower')
+
+    report = {'environment': environment(), 'config': config, 'results': results}
+
+    if outPath:
+        with open(outPath, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    return report
+
+
+def compare(baselinePath, resultsPath, tolerance=0.1):
+    """Compare benchmark results against a baseline and flag regressions.
+
+    :param baselinePath: path to a results file to compare against.
+
+    :param resultsPath: path to a results file to compare.
+
+    :param tolerance: how much worse than the baseline a result may be before it's flagged, as a fraction.
+    i.e.: 0.1 flags results over 10% slower.
+
+    :return: a dictionary per result found in both files with the baseline and new values, the change
+    (how many times better the new value is, so < 1 is worse) and whether it's a regression.
+    """
+    with open(baselinePath) as file:
+        baseline = json.load(file)
+
+    with open(resultsPath) as file:
+        current = json.load(file)
+
+    for key in sorted(set(baseline['environment']) - {'date'}):
+        if baseline['environment'][key] != current['environment'].get(key):
+            print('environment differs: {}: {} -> {}'.format(key, baseline['environment'][key], current['environment'].get(key)))
+
+    comparison = {}
+
+    for name, r in current['results'].items():
+        if name not in baseline['results']:
+            continue
+
+        b = baseline['results'][name]
+        change = r['value'] / b['value'] if r['better'] == 'higher' else b['value'] / r['value']
+        comparison[name] = {
+            'baseline': b['value'], 'value': r['value'], 'change': change, 'regression': change < 1 / (1 + tolerance)
+        }
+        print('{}{}: {:,.6g} -> {:,.6g} {} | {:,.2f}x'.format(
+            '!! ' if comparison[name]['regression'] else '', name, b['value'], r['value'], r['unit'], change
+        ))
+
+    regressions = sum(c['regression'] for c in comparison.values())
+    print('compared: {} | regressions: {}'.format(len(comparison), regressions))
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run benchmarks or compare their results against a baseline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    runParser = commands.add_parser('run', help='run the benchmark suite.')
+    runParser.add_argument('out', help='results file (.json).')
+    runParser.add_argument('--steps', type=int, default=50, help='optimizer steps to time per training benchmark.')
+    runParser.add_argument('--repeat', type=int, default=10, help='repetitions of every other benchmark.')
+    runParser.add_argument('--images', nargs='*', default=None, help='images to preprocess (default: data/*).')
+    compareParser = commands.add_parser('compare', help='compare results against a baseline.')
+    compareParser.add_argument('baseline', help='baseline results file (.json).')
+    compareParser.add_argument('results', help='results file (.json).')
+    compareParser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown (default: 0.1).')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args.out, imagePaths=args.images, steps=args.steps, repeat=args.repeat)
+    else:
+        sys.exit(any(c['regression'] for c in compare(args.baseline, args.results, args.tolerance).values()))
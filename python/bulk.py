@@ -0,0 +1,169 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import multiprocessing as mp
+import argparse
+import csv
+import json
+import os
+import hashlib
+import cv2 as cv
+
+import testing
+import modelio
+import engine
+
+"""File extensions picked up when streaming images from a directory."""
+imageExtensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+# State of a worker process (see _initWorker):
+_worker = {}
+
+
+def imagePaths(source):
+    """Stream image paths from a directory or a file list.
+
+    :param source: a directory, which is walked recursively for files with an extension in imageExtensions,
+    or a text file with one image path per line.
+
+    :return: a generator of paths.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+
+            for name in sorted(files):
+                if name.lower().endswith(imageExtensions):
+                    yield os.path.join(root, name)
+    else:
+        with open(source, 'rt') as file:
+            for line in file:
+                line = line.strip()
+
+                if line:
+                    yield line
+
+
+def classifyImages(modelPath, paths, outPath, workers=None, annotateDir=None, chunkSize=8):
+    """Classify the digits in a stream of images, without a display.
+
+    Decoding, contour extraction and prediction are spread over a process pool. Each worker loads the model
+    once. Results are written as soon as they arrive, in completion order, so partial results are
+    usable while a run is in progress.
+
+    :param modelPath: path to a '.model.gz' or '.model.bin' file (see modelio.loadModel).
+
+    :param paths: an iterable of image paths (see imagePaths).
+
+    :param outPath: path to the results file. If it ends in '.csv', one row per digit is written with
+    columns path, digit, prediction, confidence, x, y, w, h, error (images without digits get a single row
+    with empty digit columns). Otherwise one json object per image is written per line, with keys
+    path, digits (a list of Digit as objects) and error.
+
+    :param workers: how many processes to use. Defaults to the number of cores.
+
+    :param annotateDir: optional directory to write annotated copies of each image to (see testing.annotate), named
+    after the image's file name and a hash of its full path, i.e.: data/x.jpg as x.jpg.1f2e3d4c.png.
+
+    :param chunkSize: how many paths are handed to a worker at a time.
+
+    :return: a 2-tuple with the number of images processed and the number of images that failed to load or
+    to be classified.
+    """
+    if annotateDir:
+        os.makedirs(annotateDir, exist_ok=True)
+
+    isCSV = outPath.lower().endswith('.csv')
+    images, errors = 0, 0
+
+    with open(outPath, 'wt', newline='') as file, \
+            mp.Pool(workers, _initWorker, (modelPath, annotateDir)) as pool:
+        writer = csv.writer(file) if isCSV else None
+
+        if isCSV:
+            writer.writerow(['path', 'digit', 'prediction', 'confidence', 'x', 'y', 'w', 'h', 'error'])
+
+        for result in pool.imap_unordered(_classify, paths, chunkSize):
+            images += 1
+            errors += result['error'] is not None
+
+            if isCSV:
+                rows = [
+                    [result['path'], i, d['prediction'], d['confidence'], *d['box'], '']
+                    for i, d in enumerate(result['digits'])
+                ]
+
+                writer.writerows(rows or [[result['path']] + [''] * 7 + [result['error'] or '']])
+            else:
+                file.write(json.dumps(result) + '\n')
+
+            file.flush()
+
+    return images, errors
+
+
+def _initWorker(modelPath, annotateDir):
+    # Parallelism comes from the pool, don't oversubscribe cores with OpenCV threads:
+    cv.setNumThreads(1)
+    _worker.update(
+        model=engine.compileModel(modelio.loadModel(modelPath)), context=testing.ContourContext(), annotateDir=annotateDir
+    )
+
+
+def _classify(path):
+    w = _worker
+
+    # One bad image must not abort the run:
+    try:
+        img = cv.imread(path, testing.imreadFlags)
+
+        if img is None:
+            return {'path': path, 'digits': [], 'error': 'could not read image'}
+
+        digits, binary = testing.predictDigits(w['model'], img, w['context'])
+
+        if w['annotateDir']:
+            # The file name with its extension, plus a hash of the full path, so images named alike never collide:
+            name = '{}.{}.png'.format(
+                os.path.basename(path), hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+            )
+            cv.imwrite(os.path.join(w['annotateDir'], name), testing.annotate(binary, digits))
+    except Exception as e:
+        return {'path': path, 'digits': [], 'error': '{}: {}'.format(type(e).__name__, e)}
+
+    return {'path': path, 'digits': [d._asdict() for d in digits], 'error': None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Classify digits in a directory or list of images.')
+    parser.add_argument('model', help='path to a .model.gz or .model.bin file.')
+    parser.add_argument('source', help='a directory of images or a text file with one image path per line.')
+    parser.add_argument('out', help='results file (.jsonl or .csv).')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores).')
+    parser.add_argument('--annotate', default=None, help='directory to write annotated images to.')
+    args = parser.parse_args()
+
+    images, errors = classifyImages(args.model, imagePaths(args.source), args.out, args.workers, args.annotate)
+    print('images: {} | errors: {}'.format(images, errors))
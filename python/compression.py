@@ -0,0 +1,232 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import nnkit as nn
+import numpy as np
+
+import dataset
+import engine
+import modelio
+import testing
+
+
+def prune(model, amount, structured=False):
+    """Prune the smallest weights of a model by magnitude.
+
+    :param model: a nn.FFN, a path to a saved model (see modelio.loadModel) or a (key, epoch, accuracy, model)
+    entry of a training.trainMNIST best queue.
+
+    :param amount: the fraction of weights (or units) to prune in each layer, in [0, 1).
+
+    :param structured: if False, the smallest weights of each Multiply layer are set to 0. The model keeps its shape
+    and becomes sparse. If True, whole hidden units are removed instead, ranked by the norm of their incoming weights
+    times the norm of their outgoing weights. The model becomes a smaller dense model, which is what makes it faster.
+
+    :return: a 2-tuple with a pruned copy of the model and a list of masks, one per NetVar in the model's vars
+    (None for weights which aren't masked), to pass to fineTune. Structured pruning returns no masks.
+    """
+    topology = _copy(modelio.asModel(model).topology)
+    multiplies = [i for i, n in enumerate(topology) if n[0] is nn.Multiply]
+
+    if structured:
+        # Every Multiply but the last outputs hidden units. Removing unit j removes column j of its weights,
+        # entry j of the bias after it and row j of the next Multiply:
+        for i, next in zip(multiplies[:-1], multiplies[1:]):
+            w, v = topology[i][1].data, topology[next][1].data
+            score = np.linalg.norm(w, axis=0) * np.linalg.norm(v, axis=1)
+            keep = np.sort(np.argsort(-score)[:max(1, int(round(len(score) * (1 - amount))))])
+            topology[i] = (nn.Multiply, nn.NetVar(w[:, keep]))
+            topology[next] = (nn.Multiply, nn.NetVar(v[keep]))
+
+            if topology[i + 1][0] is nn.Add:
+                topology[i + 1] = (nn.Add, nn.NetVar(topology[i + 1][1].data[:, keep]))
+
+        return nn.FFN(*topology), None
+
+    for i in multiplies:
+        w = topology[i][1].data
+        w[np.abs(w) < np.quantile(np.abs(w), amount)] = 0
+
+    model = nn.FFN(*topology)
+    pruned = {id(topology[i][1]) for i in multiplies}
+    return model, [p.data != 0 if id(p) in pruned else None for p in model.vars]
+
+
+def factorize(model, rank=None, energy=0.9):
+    """Replace each Multiply layer by two thin ones, with a truncated SVD of its weights.
+
+    w (m x n) ≈ ab, where a = u_r Σ_r (m x r) and b = v_r^T (r x n) hold the top r singular values/vectors of w.
+    Layers are only factorized when that takes fewer weights (r(m + n) < mn).
+
+    :param model: see prune.
+
+    :param rank: the rank to keep in every layer. Takes precedence over energy.
+
+    :param energy: the fraction of the sum of squared singular values to keep in each layer, used to pick
+    a rank per layer when rank is None.
+
+    :return: a factorized copy of the model.
+    """
+    topology = []
+
+    for n in _copy(modelio.asModel(model).topology):
+        if n[0] is not nn.Multiply:
+            topology.append(n)
+            continue
+
+        w = n[1].data
+        u, s, vt = np.linalg.svd(w, full_matrices=False)
+        r = rank or int(np.searchsorted(np.cumsum(s ** 2) / np.sum(s ** 2), energy) + 1)
+        r = min(r, len(s))
+
+        if r * sum(w.shape) < w.size:
+            topology.extend([
+                (nn.Multiply, nn.NetVar(u[:, :r] * s[:r])),
+                (nn.Multiply, nn.NetVar(vt[:r]))
+            ])
+        else:
+            topology.append(n)
+
+    return nn.FFN(*topology)
+
+
+def fineTune(model, trainingSet, epochs, batchSize=16, learnRate=0.99, masks=None, seed=None):
+    """Train a (pruned or factorized) model for a few more epochs, in place.
+
+    :param model: a nn.FFN ending in a Softmax layer.
+
+    :param trainingSet: see training.trainMNIST.
+
+    :param epochs: the number of epochs to train for.
+
+    :param batchSize: the minibatch size.
+
+    :param learnRate: the learn rate of the gradient descent optimizer.
+
+    :param masks: optional masks, as returned by prune. Masked weights are kept at 0 after every step.
+
+    :param seed: optional seed for the random generator.
+
+    :return: the model.
+    """
+    if seed is not None:
+        np.random.seed(seed)
+
+    x, y = nn.NetVar(), nn.NetVar()
+    params = model.vars
+    masks = masks or [None] * len(params)
+    optimizer = nn.GD(params)
+    optimizer.learnRate = learnRate
+    model.topology.append((nn.CELoss, y))
+
+    try:
+        for e in range(1, epochs + 1):
+            for x.data, y.data in dataset.Minibatches(trainingSet, batchSize):
+                loss = model(x)
+                model.back()
+                optimizer.step()
+
+                for p, mask in zip(params, masks):
+                    if mask is not None:
+                        p.data *= mask
+
+            print('\t fine tune e:{} | train loss: {:,.3f}'.format(e, loss.item()))
+    finally:
+        model.topology.pop()
+        model.layers.clear()
+
+    return model
+
+
+def flops(model):
+    """Count the floating point operations to evaluate one example.
+
+    Multiply layers count 2 operations (multiply + add) per nonzero weight, which is what a sparse kernel would
+    execute. All other layers count 1 operation per output.
+
+    :param model: see prune.
+    :return: an int.
+    """
+    count, width = 0, None
+
+    for n in modelio.asModel(model).topology:
+        if n[0] is nn.Multiply:
+            count += 2 * int(np.count_nonzero(n[1].data))
+            width = n[1].data.shape[1]
+        elif n[0] in (nn.Add, nn.ReLU, nn.Softmax):
+            count += width
+
+    return count
+
+
+def parameters(model):
+    """Count the nonzero parameters of a model.
+
+    :param model: see prune.
+    :return: an int.
+    """
+    return sum(int(np.count_nonzero(p.data)) for p in modelio.asModel(model).vars)
+
+
+def report(before, after, testSet, batchSizes=(1, 64, 1024), repeat=20):
+    """Compare a model before and after compression.
+
+    :param before: the original model (see prune).
+
+    :param after: the compressed model (see prune).
+
+    :param testSet: a 2-tuple with held out examples and labels (see testing.testMNIST).
+
+    :param batchSizes: batch sizes to time inference with.
+
+    :param repeat: how many times to evaluate each batch size. The best time is kept.
+
+    :return: a dictionary with the FLOPs, parameters, test accuracy and latency per batch size of each model.
+    """
+    results = {}
+
+    for name, model in [('before', modelio.asModel(before)), ('after', modelio.asModel(after))]:
+        latency = engine.latency(model, testSet[0], batchSizes, repeat)
+
+        results[name] = {
+            'flops': flops(model),
+            'parameters': parameters(model),
+            'accuracy': testing.testMNIST(model, testSet),
+            'latency': latency
+        }
+
+        print('{}: FLOPs: {:,} | parameters: {:,} | MNIST test accuracy: {:,.2%} | latency: {}'.format(
+            name, results[name]['flops'], results[name]['parameters'], results[name]['accuracy'],
+            ' '.join('b{}: {:,.6f} sec.'.format(b, t) for b, t in latency.items())
+        ))
+
+    return results
+
+
+def _copy(topology):
+    return [
+        (n[0], *[nn.NetVar(np.array(p.data)) if type(p) is nn.NetVar else p for p in n[1:]])
+        for n in topology
+    ]
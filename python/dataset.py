@@ -0,0 +1,293 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import nnkit as nn
+import numpy as np
+import threading
+import queue
+import time
+import os
+
+"""Arrays in an MNIST .npz file, cached as one .npy file each."""
+mnistArrays = ('train_images', 'train_labels', 'test_images', 'test_labels')
+
+
+def loadMNIST(path, cacheDir=None):
+    """Load the MNIST dataset through an uncompressed, memory-mapped cache and make a validation set out of the test set.
+
+    The first load writes each array in the .npz file to its own .npy file. Later loads memory-map those files
+    read-only, so start-up doesn't read the dataset and processes loading it share the same pages.
+    The cache is rebuilt if the .npz file is newer than it.
+
+    :param path: path to the compressed dataset.
+
+    :param cacheDir: directory for the cache. Defaults to the dataset's path with a '.cache' extension instead of '.npz'.
+
+    :return: a list of 3 2-tuples where for each tuple, the first element contains examples and the second element
+    contains the target labels for each example, as uint8 class indices (see oneHot). Tuples are for the training,
+    validation and test sets. The validation and test sets are views of halves of the MNIST test set.
+    """
+    cacheDir = cacheDir or os.path.splitext(path)[0] + '.cache'
+    files = {name: os.path.join(cacheDir, name + '.npy') for name in mnistArrays}
+
+    if not all(os.path.exists(f) and os.path.getmtime(f) >= os.path.getmtime(path) for f in files.values()):
+        os.makedirs(cacheDir, exist_ok=True)
+
+        with np.load(path) as data:
+            for name, file in files.items():
+                array = data[name]
+
+                if name.endswith('labels'):
+                    array = classIndices(array).astype(np.uint8)
+
+                # Write then rename, so concurrent loads never map a partial file:
+                temp = '{}.{}.tmp.npy'.format(file[:-len('.npy')], os.getpid())
+                np.save(temp, np.ascontiguousarray(array))
+                os.replace(temp, file)
+
+    data = {name: np.load(file, mmap_mode='r') for name, file in files.items()}
+
+    # Use half the test set for validation:
+    halfSize = len(data['test_images']) // 2
+
+    return [
+        [data['train_images'], data['train_labels']],
+        [data['test_images'][:halfSize], data['test_labels'][:halfSize]],
+        [data['test_images'][halfSize:], data['test_labels'][halfSize:]]
+    ]
+
+
+def oneHot(labels, classes=10):
+    """Make labels into one-hot vectors suitable for a softmax layer.
+
+    :param labels: class indices. Labels which are already one-hot are returned unchanged.
+    :param classes: the number of classes.
+
+    :return: a (len(labels), classes) array of nn.dtype.
+    """
+    if labels.ndim != 1:
+        return labels
+
+    hot = np.zeros((len(labels), classes), nn.dtype)
+    hot[np.arange(len(labels)), labels] = 1
+    return hot
+
+
+def classIndices(labels):
+    """Make labels into class indices.
+
+    :param labels: one-hot vectors or class indices, which are returned unchanged.
+    :return: a 1d array of class indices.
+    """
+    return labels if labels.ndim == 1 else np.argmax(labels, axis=1)
+
+
+def chunks(dataSet, chunkSize, indices=None):
+    """Iterate over a dataset in order, in fixed-size chunks.
+
+    Examples are converted to nn.dtype into a single reused buffer, so memory doesn't grow with the size of the set.
+
+    :param dataSet: a 2-tuple where the first element contains examples and the second element
+    contains the target labels for each example, as class indices or in one-hot form.
+
+    :param chunkSize: the number of examples per chunk. The last chunk can be smaller.
+
+    :param indices: optional indices of the examples to iterate over (i.e.: see stratifiedSample).
+
+    :return: a generator of (x, labels) chunks, with labels as class indices. x is a view of a buffer
+    which is reused for the next chunk, so it shouldn't be held on to.
+    """
+    examples, labels = dataSet
+    examples = examples.reshape(len(examples), -1)
+    labels = classIndices(labels)
+    n = len(examples) if indices is None else len(indices)
+    buffer = np.empty((min(chunkSize, n), examples.shape[1]), nn.dtype)
+
+    for i in range(0, n, chunkSize):
+        ids = slice(i, min(i + chunkSize, n)) if indices is None else indices[i:i + chunkSize]
+        x = buffer[:len(labels[ids])]
+        np.copyto(x, examples[ids])
+        yield x, labels[ids]
+
+
+def stratifiedSample(labels, size, seed=0):
+    """Pick a random subsample of a dataset with the same proportion of each class as the whole set.
+
+    :param labels: class indices or one-hot labels.
+
+    :param size: the number of examples to pick.
+
+    :param seed: seed of the (private) random generator used to pick, so the same arguments always pick the
+    same subsample and numpy's global random state is left alone.
+
+    :return: a sorted array of example indices.
+    """
+    labels = classIndices(labels)
+    size = min(size, len(labels))
+    random = np.random.RandomState(seed)
+    classes, counts = np.unique(labels, return_counts=True)
+
+    # Largest remainder rounding, so per class sizes add up to size:
+    quotas = counts * size / len(labels)
+    sizes = np.floor(quotas).astype(int)
+    sizes[np.argsort(sizes - quotas)[:size - np.sum(sizes)]] += 1
+
+    return np.sort(np.concatenate([
+        random.choice(np.flatnonzero(labels == c), n, replace=False) for c, n in zip(classes, sizes)
+    ]))
+
+
+class Minibatches:
+    """Shuffled minibatches of a dataset, gathered into reusable buffers.
+
+    Each epoch shuffles the example indices and gathers batches into a small ring of preallocated buffers,
+    converting examples to nn.dtype and labels to one-hot on the way. Optionally, the next batches are
+    gathered in a background thread while the current one is being trained on.
+
+    Attributes:
+    . waited: total time (in seconds) spent waiting for batches, whether gathered synchronously or prefetched.
+    """
+    def __init__(self, dataSet, batchSize, prefetch=0, scale=None, classes=10, transform=None):
+        """
+        :param dataSet: a 2-tuple where the first element contains examples and the second element
+        contains the target labels for each example, as class indices or in one-hot form.
+
+        :param batchSize: the number of examples per batch. The last batch of an epoch can be smaller.
+
+        :param prefetch: how many batches to gather ahead in a background thread. 0 gathers each batch
+        when it is requested.
+
+        :param scale: an optional factor to multiply examples by while gathering (i.e.: 1/255 for raw pixels).
+
+        :param classes: the number of classes in one-hot labels.
+
+        :param transform: an optional callable taking a gathered batch of examples and their indices in the dataset
+        and modifying the batch in place (i.e.: augmentation.Augmentation). It runs wherever batches are gathered,
+        so with prefetch it runs in the background thread.
+        """
+        self.examples, self.labels = dataSet
+        self.batchSize, self.prefetch, self.scale, self.transform = batchSize, prefetch, scale, transform
+        self.idx = np.arange(len(self.examples))
+        self.rows = np.arange(batchSize)
+        self.waited = 0.
+
+        # A batch being trained on, one being gathered and up to prefetch ready ones:
+        n = len(self.examples[0].ravel())
+        self.x = [np.empty((batchSize, n), nn.dtype) for _ in range(prefetch + 2)]
+        self.y = [np.empty((batchSize, classes), nn.dtype) for _ in range(prefetch + 2)]
+
+    def __iter__(self):
+        """Shuffle the examples and iterate over one epoch.
+
+        Shuffling happens on the calling thread, so the random state advances exactly as with np.random.shuffle
+        on a list of indices.
+
+        :return: a generator of (x, y) batches. Batches are views of buffers which are reused after the
+        next batch is requested, so they shouldn't be held on to.
+        """
+        np.random.shuffle(self.idx)
+        batches = range(0, len(self.idx), self.batchSize)
+
+        if not self.prefetch:
+            for i in batches:
+                t = time.perf_counter()
+                batch = self._gather(0, self.idx[i:i + self.batchSize])
+                self.waited += time.perf_counter() - t
+                yield batch
+
+            return
+
+        free, ready = queue.Queue(), queue.Queue()
+        stop = threading.Event()
+
+        for slot in range(len(self.x)):
+            free.put(slot)
+
+        def produce():
+            try:
+                for i in batches:
+                    slot = None
+
+                    while slot is None and not stop.is_set():
+                        try:
+                            slot = free.get(timeout=0.1)
+                        except queue.Empty:
+                            pass
+
+                    if stop.is_set():
+                        return
+
+                    ready.put((slot, self._gather(slot, self.idx[i:i + self.batchSize])))
+
+                ready.put(None)
+            except Exception as e:
+                ready.put(e)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        try:
+            while True:
+                t = time.perf_counter()
+                item = ready.get()
+                self.waited += time.perf_counter() - t
+
+                if item is None:
+                    break
+
+                if isinstance(item, Exception):
+                    raise item
+
+                slot, batch = item
+                yield batch
+                free.put(slot)
+        finally:
+            stop.set()
+            producer.join()
+
+    def _gather(self, slot, ids):
+        n = len(ids)
+        x, y = self.x[slot][:n], self.y[slot][:n]
+        examples = self.examples.reshape(len(self.examples), -1)
+
+        # Gather straight into the buffer when no conversion is needed (clip mode avoids take's extra buffering):
+        if examples.dtype == x.dtype:
+            np.take(examples, ids, axis=0, out=x, mode='clip')
+        else:
+            np.copyto(x, examples[ids])
+
+        if self.scale is not None:
+            x *= self.scale
+
+        if self.transform:
+            self.transform(x, ids)
+
+        if self.labels.ndim == 1:
+            y.fill(0)
+            y[self.rows[:n], self.labels[ids]] = 1
+        else:
+            np.copyto(y, self.labels[ids])
+
+        return x, y
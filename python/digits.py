@@ -24,13 +24,16 @@
 # SOFTWARE.
 
 
-import numpy as np
 import nnkit as nn
+import argparse
 import json, glob, os
 
 import testing
 import training
 import statsplot
+import modelio
+import engine
+import dataset
 
 
 def loadMNISTData(path):
@@ -40,31 +43,17 @@ def loadMNISTData(path):
 
     :return: a list of 3 2-tuples where for each tuple, the first element contains examples and the second element
     contains the target labels for each example. Tuples are for the training, validation and test sets.
+    Arrays are memory-mapped from a cache next to the dataset and labels are class indices (see dataset.loadMNIST).
     """
-    sets = []
+    return dataset.loadMNIST(path)
 
-    with np.load(path) as data:
-        sets.append([data["train_images"], data["train_labels"]])
-        sets.append([data["test_images"], data["test_labels"]])
 
-    # Make outputs into one-hot vectors suitable for a 10 unit softmax layer:
-    for s in sets:
-        size = s[0].shape[0], 10
-        hot = np.zeros(size)
-        hot[range(size[0]), s[1]] = 1
-        s[1] = hot
+def train(trainingSet, validationSet, resume=False, overwrite=False):
+    """Train a series of models with hyper parameter combinations.
 
-    # Use half the test set for validation:
-    testSet = sets[1]
-    halfSize = len(testSet[0]) // 2
-    validationSet = [testSet[0][0:halfSize], testSet[1][0:halfSize]]
-    testSet = [testSet[0][halfSize:], testSet[1][halfSize:]]
-
-    return [sets[0], validationSet, testSet]
-
-
-def train(trainingSet, validationSet):
-    """Train a series of models with hyper parameter combinations."""
+    :param resume: whether to resume an interrupted session from its checkpoints. Otherwise its stats log starts over.
+    :param overwrite: whether to delete the checkpoints of a previous session and start over.
+    """
     stats, bestModels = training.trainMNIST(
         trainingSet=trainingSet,
         validationSet=validationSet,
@@ -72,7 +61,12 @@ def train(trainingSet, validationSet):
         layers=[(170,), (300,), (900,), (300, 300), (900, 100), (170, 100, 70), (300, 200, 100)],
         batchSizes=[16, 32, 128],
         learnRates=[('0.99', lambda epochs, e: 0.99)],
-        keepBest=5
+        keepBest=5,
+        workers=os.cpu_count(),
+        checkpointDir='checkpoints',
+        resume=resume,
+        overwrite=overwrite,
+        statsLog='digits-stats.jsonl'
     )
 
     # Save best models and stats:
@@ -88,9 +82,7 @@ def train(trainingSet, validationSet):
 def test(testSetMNIST):
     """Test a model against MNIST test set and custom images."""
     for path in glob.glob('training/*.model.gz'):
-        path.replace(".model.gz", "")
-
-        model = nn.FFN(*nn.load(path.replace(".model.gz", "")))
+        model = engine.compileModel(modelio.loadModel(path))
 
         # Test accuracy in MNIST:
         accuracy = testing.testMNIST(model, testSetMNIST)
@@ -112,13 +104,52 @@ def test(testSetMNIST):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train and test digit classifiers.')
+    parser.add_argument('--resume', action='store_true', help='resume an interrupted session from its checkpoints.')
+    parser.add_argument('--overwrite', action='store_true', help='delete the checkpoints of a previous session.')
+    args = parser.parse_args()
+
     trainingSet, validationSet, testSet = loadMNISTData('data/mnist.dataset.npz')
 
     # Uncomment to train:
-    train(trainingSet, validationSet)
+    train(trainingSet, validationSet, args.resume, args.overwrite)
 
     # Uncomment to test:
     test(testSet)
 
     # Uncomment to plot a specific model (use filename):
     # statsplot.plotStats("(100, (300,), 16, '0.99')", 'digits-stats.json', 100, [], False)
+
+    # Uncomment to follow a model while it trains (from another process):
+    # statsplot.followStats("(100, (300,), 16, '0.99')", 'digits-stats.jsonl', 100)
+
+    # Uncomment to plot all models and a leaderboard into a directory, without a display:
+    # print(statsplot.plotReport('digits-stats.jsonl', 'report', 100))
+
+    # Uncomment to quantize a model and compare it against the original:
+    # import quantization
+    # quantization.report(glob.glob('training/*.model.gz')[0], testSet)
+
+    # Uncomment to remove half the hidden units of a model, fine tune it and compare it against the original:
+    # import compression
+    # original = glob.glob('training/*.model.gz')[0]
+    # pruned, masks = compression.prune(original, 0.5, structured=True)
+    # compression.fineTune(pruned, trainingSet, 5, masks=masks)
+    # compression.report(original, pruned, testSet)
+
+    # Uncomment to distill the best models of a session into a single hidden layer of 64 units and compare them:
+    # import distillation
+    # teachers = glob.glob('training/*.model.gz')
+    # stats, student = distillation.distill(teachers, trainingSet, validationSet, 20, layers=(64,), cacheDir='logits')
+    # distillation.report(teachers, student, testSet)
+
+    # Uncomment to compare the latency of a model evaluated by NNKit and compiled:
+    # engine.benchmark(modelio.loadModel(glob.glob('training/*.model.gz')[0]))
+
+    # Uncomment to compare digit detection at full resolution and coarse to fine on the custom images:
+    # testing.benchmarkPyramid(modelio.loadModel(glob.glob('training/*.model.gz')[0]), glob.glob('data/*.*'))
+
+    # Uncomment to classify digits in a camera stream (or a video file or directory of frames):
+    # import streaming
+    # for frame in streaming.stream(modelio.loadModel(glob.glob('training/*.model.gz')[0]), streaming.frameSource(0)):
+    #     print(frame.index, [d.prediction for d in frame.digits], frame.latency, frame.hitRate)
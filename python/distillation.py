@@ -0,0 +1,219 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import nnkit as nn
+import numpy as np
+import hashlib
+import os
+
+import dataset
+import engine
+import modelio
+import testing
+import training
+
+
+def teacherLogits(teachers, examples, cacheDir=None, chunkSize=1000):
+    """Compute the logits (outputs before the last Softmax) of each teacher on a set of examples, once.
+
+    Logits are cached to disk in a file named after a hash of the teachers' weights and the examples, and memory-mapped
+    on later calls, so a student's epochs (or later distillations from the same teachers) don't re-run the teachers.
+
+    :param teachers: a list of models ending in a Softmax layer. Each model is a nn.FFN, a path to a saved model
+    (see modelio.loadModel) or a (key, epoch, accuracy, model) entry of a training.trainMNIST best queue.
+
+    :param examples: the examples to compute logits for, as in the training set of training.trainMNIST.
+
+    :param cacheDir: optional directory to cache logits in. Without it, logits are computed in memory.
+
+    :param chunkSize: how many examples to evaluate per forward pass.
+
+    :return: a (teachers, examples, classes) float32 array.
+    """
+    teachers = [modelio.asModel(t) for t in teachers]
+    path = None
+
+    if cacheDir:
+        digest = hashlib.sha1(np.array(examples.shape).tobytes())
+        digest.update(np.ascontiguousarray(examples).data)
+
+        for teacher in teachers:
+            for p in teacher.vars:
+                digest.update(np.ascontiguousarray(p.data).data)
+
+            digest.update(b'|')
+
+        path = os.path.join(cacheDir, 'logits-{}.npy'.format(digest.hexdigest()[:16]))
+
+        if os.path.exists(path):
+            return np.load(path, mmap_mode='r')
+
+    logits = None
+
+    for i, teacher in enumerate(teachers):
+        # Drop the Softmax layer:
+        net, x = nn.FFN(*teacher.topology[:-1]), nn.NetVar()
+        start = 0
+
+        for x.data, _ in dataset.chunks((examples, np.zeros(len(examples), np.uint8)), chunkSize):
+            out = net(x)
+
+            if logits is None:
+                logits = np.empty((len(teachers), len(examples), out.shape[1]), nn.dtype)
+
+            logits[i, start:start + len(out)] = out
+            start += len(out)
+
+    if path:
+        os.makedirs(cacheDir, exist_ok=True)
+
+        # Write then rename, so an interrupted write never leaves a partial cache:
+        temp = '{}.{}.tmp.npy'.format(path[:-len('.npy')], os.getpid())
+        np.save(temp, logits)
+        os.replace(temp, path)
+
+    return logits
+
+
+def softTargets(logits, labels=None, temperature=1., alpha=1.):
+    """Average the teachers' softmax outputs into soft targets.
+
+    :param logits: teacher logits, as returned by teacherLogits.
+
+    :param labels: labels of the examples, as class indices or in one-hot form. Only needed if alpha < 1.
+
+    :param temperature: softmax temperature. Higher temperatures give more weight to the classes a teacher
+    considers unlikely, which is most of what a student learns from soft targets.
+
+    :param alpha: the weight of soft targets. The rest goes to the labels. Cross entropy is linear in its targets,
+    so training on mixed targets is the same as mixing the soft and hard losses.
+
+    :return: a (examples, classes) float32 array of targets, which can replace the labels of a training set.
+    """
+    z = np.asarray(logits, np.float64) / temperature
+    z -= np.max(z, axis=2, keepdims=True)
+    p = np.exp(z)
+    p /= np.sum(p, axis=2, keepdims=True)
+    targets = np.mean(p, axis=0)
+
+    if alpha < 1:
+        targets = alpha * targets + (1 - alpha) * dataset.oneHot(dataset.classIndices(labels), targets.shape[1])
+
+    return targets.astype(nn.dtype)
+
+
+def distill(teachers, trainingSet, validationSet, epochs, layers=(100,), batchSize=16,
+            learnRate=('0.99', lambda epochs, e: 0.99), temperature=1., alpha=1., cacheDir=None, seed=None, prefetch=0,
+            augmentation=None):
+    """Train a small student model on the averaged predictions of larger teacher models.
+
+    The student is trained like any model of training.trainMNIST (see training.Trainer), except that its targets
+    are the teachers' soft targets (see softTargets) instead of the training labels. It is validated on the labels
+    of the validation set, and the best epoch is kept.
+
+    :param teachers: see teacherLogits. i.e.: the best queue returned by training.trainMNIST.
+
+    :param trainingSet, validationSet: see training.trainMNIST.
+
+    :param epochs: the number of epochs to train the student for.
+
+    :param layers: the hidden layers of the student.
+
+    :param batchSize: the minibatch size.
+
+    :param learnRate: a (name, lambda) learn rate (see training.trainMNIST).
+
+    :param temperature, alpha: see softTargets.
+
+    :param cacheDir: optional directory to cache teacher logits in (see teacherLogits).
+
+    :param seed: optional seed for the student's initial weights and minibatches.
+
+    :param prefetch, augmentation: see training.trainMNIST. Augmentation changes examples after their targets
+    were computed, so it should be mild.
+
+    :return: a 2-tuple with the student's stats and the student (a nn.FFN).
+    """
+    examples, labels = trainingSet
+    logits = teacherLogits(teachers, examples, cacheDir)
+    targets = softTargets(logits, labels, temperature, alpha)
+
+    trainer = training.Trainer(
+        0, (layers, batchSize, learnRate), (examples, targets), validationSet, epochs, 1, seed, prefetch,
+        augmentation=augmentation
+    ).train()
+
+    return trainer.stats, trainer.best[-1][3]
+
+
+def report(teachers, student, testSet, batchSizes=(1, 64, 1024), repeat=20):
+    """Compare a student against its teachers and their ensemble.
+
+    :param teachers: see teacherLogits.
+
+    :param student: see teacherLogits.
+
+    :param testSet: a 2-tuple with held out examples and labels (see testing.testMNIST).
+
+    :param batchSizes: batch sizes to time inference with.
+
+    :param repeat: how many times to evaluate each batch size. The best time is kept.
+
+    :return: a dictionary with the test accuracy and latency per batch size of each teacher, the ensemble (the average
+    of all teachers, whose latency is the sum of theirs) and the student, plus the student's speedup over each of them.
+    """
+    models = [('teacher {}'.format(i), modelio.asModel(t)) for i, t in enumerate(teachers)]
+    models.append(('student', modelio.asModel(student)))
+    results = {}
+
+    for name, model in models:
+        latency = engine.latency(model, testSet[0], batchSizes, repeat)
+
+        results[name] = {'accuracy': testing.testMNIST(model, testSet), 'latency': latency}
+
+    # The ensemble predicts the class with the highest average softmax output:
+    probabilities = softTargets(teacherLogits([m for _, m in models[:-1]], testSet[0]))
+    ensembleAccuracy = np.mean(np.argmax(probabilities, axis=1) == dataset.classIndices(testSet[1]))
+    results['ensemble'] = {
+        'accuracy': float(ensembleAccuracy),
+        'latency': {b: sum(results[n]['latency'][b] for n, _ in models[:-1]) for b in batchSizes}
+    }
+
+    for name in [n for n, _ in models] + ['ensemble']:
+        if name != 'student':
+            results[name]['speedup'] = {
+                b: results[name]['latency'][b] / results['student']['latency'][b] for b in batchSizes
+            }
+
+        print('{}: MNIST test accuracy: {:,.2%} | latency: {}{}'.format(
+            name, results[name]['accuracy'],
+            ' '.join('b{}: {:,.6f} sec.'.format(b, t) for b, t in results[name]['latency'].items()),
+            '' if name == 'student' else ' | student speedup: ' + ' '.join(
+                'b{}: {:,.2f}x'.format(b, s) for b, s in results[name]['speedup'].items()
+            )
+        ))
+
+    return results
+
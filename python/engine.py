@@ -0,0 +1,240 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import OrderedDict
+import nnkit as nn
+import numpy as np
+import time
+
+
+class Plan:
+    """A model compiled for inference: a flat list of steps run in place over preallocated float32 buffers.
+
+    Each step is one of:
+    . ('affine', w, b, relu): x = xw (+ b) (then max(x, 0)), into the step's buffer. Multiply/Add/ReLU layers
+      are fused into a single step, so the bias and ReLU are applied in place over the product.
+    . ('add', b, relu), ('relu',), ('softmax',): in place over the previous step's buffer.
+
+    Buffers are allocated the first time the plan runs with a batch size and reused for later calls with that size.
+    The output of a call is one of these buffers, so it is overwritten by the next call with the same batch size.
+    Copy it to keep it. For the same reason, a plan must not be called from several threads at once.
+
+    Attributes:
+    . steps: the list of steps.
+    . maxBatchSizes: how many batch sizes to keep buffers for. The least recently used are dropped first.
+    """
+    def __init__(self, model, maxBatchSizes=8):
+        """Compile a model.
+
+        :param model: a nn.FFN (or topology, as a list of tuples) made of Multiply, Add, ReLU and Softmax layers.
+        :param maxBatchSizes: see class attributes.
+        """
+        topology = model.topology if isinstance(model, nn.FFN) else model
+        self.steps = []
+        self.maxBatchSizes = maxBatchSizes
+        self._buffers = OrderedDict()
+
+        for n in topology:
+            op, args = n[0], [np.ascontiguousarray(a.data, dtype=nn.dtype) for a in n[1:]]
+            last = self.steps[-1] if self.steps else None
+
+            if op is nn.Multiply:
+                self.steps.append(['affine', args[0], None, False])
+            elif op is nn.Add and last and last[0] == 'affine' and last[2] is None and not last[3]:
+                last[2] = args[0]
+            elif op is nn.Add:
+                self.steps.append(['add', args[0], False])
+            elif op is nn.ReLU and last and last[0] in ('affine', 'add') and not last[-1]:
+                last[-1] = True
+            elif op is nn.ReLU:
+                self.steps.append(['relu'])
+            elif op is nn.Softmax:
+                self.steps.append(['softmax'])
+            else:
+                raise ValueError('cannot compile {} layers.'.format(op.__name__))
+
+        self.steps = [tuple(s) for s in self.steps]
+
+    def __call__(self, x):
+        """Evaluate an input.
+
+        :param x: a NetVar or array of examples, one per row.
+        :return: the output of the last layer (see class docs on buffer reuse).
+        """
+        x = x.data if isinstance(x, nn.NetVar) else np.asarray(x, dtype=nn.dtype)
+        x = x.reshape(1, -1) if x.ndim == 1 else x
+        buffers, rows = self.buffers(len(x))
+        i = 0
+
+        for step in self.steps:
+            kind = step[0]
+
+            if kind == 'affine':
+                _, w, b, relu = step
+                out = buffers[i]
+                i += 1
+                np.matmul(x, w, out=out)
+
+                if b is not None:
+                    np.add(out, b, out=out)
+
+                if relu:
+                    np.maximum(out, 0, out=out)
+
+                x = out
+            elif kind == 'add':
+                _, b, relu = step
+                x = _writable(x, i)
+                np.add(x, b, out=x)
+
+                if relu:
+                    np.maximum(x, 0, out=x)
+            elif kind == 'relu':
+                x = _writable(x, i)
+                np.maximum(x, 0, out=x)
+            elif kind == 'softmax':
+                # Same operations as nn.Softmax, in place:
+                x = _writable(x, i)
+                np.max(x, axis=1, keepdims=True, out=rows)
+                np.subtract(x, rows, out=x)
+                np.exp(x, out=x)
+                np.sum(x, axis=1, keepdims=True, out=rows)
+                np.divide(x, rows, out=x)
+
+        return x
+
+    def buffers(self, batchSize):
+        """Get the buffers for a batch size, allocating them if needed.
+
+        :param batchSize: the number of examples per call.
+        :return: a 2-tuple with a list of one buffer per affine step and a (batchSize, 1) buffer for row reductions.
+        """
+        if batchSize in self._buffers:
+            self._buffers.move_to_end(batchSize)
+        else:
+            self._buffers[batchSize] = (
+                [np.empty((batchSize, s[1].shape[1]), dtype=nn.dtype) for s in self.steps if s[0] == 'affine'],
+                np.empty((batchSize, 1), dtype=nn.dtype)
+            )
+
+            while len(self._buffers) > self.maxBatchSizes:
+                self._buffers.popitem(last=False)
+
+        return self._buffers[batchSize]
+
+
+def compileModel(model, maxBatchSizes=8):
+    """Compile a model into an inference plan.
+
+    :param model, maxBatchSizes: see Plan.
+    :return: a Plan, which can be called in place of the model.
+    """
+    return Plan(model, maxBatchSizes)
+
+
+def benchmark(model, batchSizes=tuple(2 ** i for i in range(13)), repeat=50, tolerance=1e-5):
+    """Compare the latency of a model evaluated by nnkit and compiled into a plan.
+
+    :param model: a nn.FFN.
+
+    :param batchSizes: batch sizes to time. Defaults to powers of 2 from 1 to 4096.
+
+    :param repeat: how many times to evaluate each batch size. The best time is kept.
+
+    :param tolerance: the largest absolute difference allowed between outputs of both.
+
+    :return: a dictionary with the best nnkit and plan latency in seconds, speedup and largest output difference
+    per batch size.
+    """
+    plan = compileModel(model)
+    inputSize = plan.steps[0][1].shape[0]
+    results = {}
+
+    for batchSize in batchSizes:
+        x = nn.NetVar(np.random.rand(batchSize, inputSize))
+        difference = float(np.max(np.abs(model(x) - plan(x))))
+
+        if difference > tolerance:
+            raise AssertionError('batch size {}: plan output differs from model by {}.'.format(batchSize, difference))
+
+        times = {name: bestTime(lambda: f(x), repeat) for name, f in [('nnkit', model), ('plan', plan)]}
+
+        results[batchSize] = dict(times, speedup=times['nnkit'] / times['plan'], difference=difference)
+        print('b{}: nnkit: {:,.6f} sec. | plan: {:,.6f} sec. | speedup: {:,.2f}x | max difference: {:.1e}'.format(
+            batchSize, times['nnkit'], times['plan'], results[batchSize]['speedup'], difference
+        ))
+
+    return results
+
+
+def bestTime(f, repeat=20, warmup=1):
+    """Time a function, keeping its fastest call, which is the least noisy estimate of what it costs.
+
+    :param f: a function taking no arguments.
+
+    :param repeat: how many calls to time.
+
+    :param warmup: how many untimed calls to make first.
+
+    :return: the best time in seconds.
+    """
+    for _ in range(warmup):
+        f()
+
+    best = np.inf
+
+    for _ in range(repeat):
+        t = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - t)
+
+    return best
+
+
+def latency(model, examples, batchSizes=(1, 64, 1024), repeat=20):
+    """Time a model on the first examples of a set at several batch sizes.
+
+    :param model: a nn.FFN (or anything called with a NetVar, like a Plan).
+
+    :param examples: examples to evaluate, as in the test set of testing.testMNIST.
+
+    :param batchSizes: batch sizes to time.
+
+    :param repeat: how many times to evaluate each batch size (see bestTime).
+
+    :return: a dictionary of best times in seconds, per batch size.
+    """
+    results = {}
+
+    for batchSize in batchSizes:
+        x = nn.NetVar(examples[:batchSize])
+        results[batchSize] = bestTime(lambda: model(x), repeat)
+
+    return results
+
+
+def _writable(x, i):
+    # In place steps before the first affine step would write over the input, so they get a copy:
+    return x if i else np.array(x)
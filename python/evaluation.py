@@ -0,0 +1,90 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import nnkit as nn
+import numpy as np
+
+import dataset
+
+
+class Evaluation:
+    """Running accuracy, loss and confusion matrix of a model, accumulated one chunk of predictions at a time.
+
+    Attributes:
+    . count: the number of examples evaluated.
+    . confusion: a (classes, classes) matrix with the number of examples of each target class (rows)
+      predicted as each class (columns).
+    """
+    def __init__(self, classes=10):
+        self.count = 0
+        self.lossSum = 0.
+        self.confusion = np.zeros((classes, classes), np.int64)
+
+    def add(self, prediction, target, loss=None):
+        """Accumulate a chunk of predictions.
+
+        :param prediction: a (n, classes) array of class probabilities.
+
+        :param target: n class indices.
+
+        :param loss: the mean loss of the chunk. Defaults to the cross entropy of prediction.
+        """
+        if loss is None:
+            loss = -np.mean(np.log(prediction[np.arange(len(target)), target]))
+
+        np.add.at(self.confusion, (target, np.argmax(prediction, axis=1)), 1)
+        self.lossSum += float(loss) * len(target)
+        self.count += len(target)
+
+    @property
+    def accuracy(self):
+        """The fraction of examples predicted correctly so far."""
+        return np.trace(self.confusion) / max(self.count, 1)
+
+    @property
+    def loss(self):
+        """The mean loss over all examples so far."""
+        return self.lossSum / max(self.count, 1)
+
+
+def evaluate(model, dataSet, chunkSize=1000, indices=None):
+    """Evaluate a model over a dataset in chunks, so peak memory doesn't depend on the size of the set.
+
+    :param model: a model to evaluate, ending in a softmax layer.
+
+    :param dataSet: a 2-tuple of examples and labels, as class indices or in one-hot form.
+
+    :param chunkSize: how many examples to evaluate per forward pass.
+
+    :param indices: optional indices of a subset of examples to evaluate (see dataset.stratifiedSample).
+
+    :return: an Evaluation.
+    """
+    evaluation = Evaluation()
+
+    for x, labels in dataset.chunks(dataSet, chunkSize, indices):
+        evaluation.add(model(nn.NetVar(x)), labels)
+
+    return evaluation
@@ -0,0 +1,242 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import nnkit as nn
+import numpy as np
+import json
+import os
+import struct
+import time
+
+"""Binary model container:
+
+. magic (8 bytes): b'NNKITBIN'.
+. version (uint32, little-endian).
+. header size (uint32, little-endian).
+. header: utf-8 json list of {'op': name, 'args': [...]}, like nnkit's gzipped json, except that array arguments
+  are replaced by {'shape': [...], 'offset': n}, the absolute offset of their weight block in the file.
+. weight blocks: raw little-endian float32, row major, each starting at a multiple of `alignment` bytes.
+"""
+magic = b'NNKITBIN'
+version = 1
+alignment = 64
+dtype = np.dtype('<f4')
+
+
+def save(topology, path):
+    """Save topology (list of tuples) to a binary model file.
+
+    :param topology: a list of tuples, as in nn.FFN.topology.
+    :param path: the path to save to, without extension. '.model.bin' is appended.
+    """
+    blocks = [
+        [np.ascontiguousarray(arg.data, dtype=dtype) if type(arg) is nn.NetVar else arg for arg in n[1:]]
+        for n in topology
+    ]
+
+    def header(start):
+        # Replace arrays with their shape and absolute offset in the file:
+        offset, entries = start, []
+
+        for n, args in zip(topology, blocks):
+            entry = {'op': n[0].__name__, 'args': []}
+
+            for arg in args:
+                if type(arg) is np.ndarray:
+                    entry['args'].append({'shape': list(arg.shape), 'offset': offset})
+                    offset += _align(arg.nbytes)
+                else:
+                    entry['args'].append(arg)
+
+            entries.append(entry)
+
+        return json.dumps(entries).encode('utf-8'), offset
+
+    # Offsets are part of the header, so grow the start of the first block until the header fits before it:
+    start = 0
+
+    while True:
+        encoded, end = header(start)
+
+        if len(magic) + 8 + len(encoded) <= start:
+            break
+
+        start = _align(len(magic) + 8 + len(encoded))
+
+    # Write then rename, so processes which have the previous file memory-mapped (see load) keep reading it
+    # instead of crashing on a truncated mapping:
+    temp = '{}.model.bin.{}.tmp'.format(path, os.getpid())
+
+    with open(temp, 'wb') as file:
+        file.write(magic)
+        file.write(struct.pack('<II', version, len(encoded)))
+        file.write(encoded)
+        file.seek(start)
+
+        for arg in [arg for args in blocks for arg in args if type(arg) is np.ndarray]:
+            file.write(arg.tobytes())
+            file.write(bytes(_align(arg.nbytes) - arg.nbytes))
+
+    os.replace(temp, path + '.model.bin')
+
+
+def load(path, mode='r'):
+    """Load topology (list of tuples) from a binary model file.
+
+    Weights are zero-copy views into a memory map of the file, so loading doesn't read or parse them
+    and processes loading the same file share its pages.
+
+    :param path: the path to load from, without extension.
+
+    :param mode: np.memmap mode. The default ('r') maps the weights read-only, which is all inference needs.
+    Use 'c' (copy on write) to train or otherwise modify the loaded weights.
+
+    :return: a list of tuples which can be passed to nn.FFN.
+    """
+    buffer = np.memmap(path + '.model.bin', dtype=np.uint8, mode=mode)
+
+    if bytes(buffer[:len(magic)]) != magic:
+        raise ValueError('{}.model.bin: not a binary model file.'.format(path))
+
+    fileVersion, headerSize = struct.unpack('<II', bytes(buffer[len(magic):len(magic) + 8]))
+
+    if fileVersion != version:
+        raise ValueError('{}.model.bin: unsupported version {}.'.format(path, fileVersion))
+
+    start = len(magic) + 8
+    header = json.loads(bytes(buffer[start:start + headerSize]).decode('utf-8'))
+
+    def arg(a):
+        if type(a) is not dict:
+            return a
+
+        size = int(np.prod(a['shape'])) * dtype.itemsize
+        block = buffer[a['offset']:a['offset'] + size].view(dtype).reshape(a['shape'])
+        return nn.NetVar(block)
+
+    return [(getattr(nn, d['op']), *[arg(a) for a in d['args']]) for d in header]
+
+
+def loadModel(path):
+    """Load a model in any format.
+
+    :param path: path to a '.model.gz' (nnkit json), '.model.bin' (binary) or '.qmodel.npz' (quantized) file.
+    :return: a nn.FFN.
+    """
+    if path.endswith('.qmodel.npz'):
+        # Here, since quantization imports modelio:
+        import quantization
+        return nn.FFN(*quantization.load(path[:-len('.qmodel.npz')]))
+
+    if path.endswith('.model.bin'):
+        return nn.FFN(*load(path[:-len('.model.bin')]))
+
+    if path.endswith('.model.gz'):
+        return nn.FFN(*nn.load(path[:-len('.model.gz')]))
+
+    raise ValueError('{}: unknown model format.'.format(path))
+
+
+def asModel(model):
+    """Get a model from any of the ways modules take one.
+
+    :param model: a nn.FFN, a path to a saved model (see loadModel) or a (key, epoch, accuracy, model) entry
+    of a training.trainMNIST best queue.
+
+    :return: a nn.FFN.
+    """
+    if type(model) is str:
+        return loadModel(model)
+
+    if type(model) is tuple:
+        return model[3]
+
+    return model
+
+
+def convert(path):
+    """Convert a nnkit gzipped json model to the binary format.
+
+    :param path: path to a '.model.gz' file.
+    :return: the path to the converted '.model.bin' file, next to the original.
+    """
+    path = path[:-len('.model.gz')]
+    save(nn.load(path), path)
+    return path + '.model.bin'
+
+
+def benchmarkLoad(path, repeat=10):
+    """Compare load times of a model in both formats.
+
+    :param path: path to a '.model.gz' file. It is converted to binary if needed.
+    :param repeat: how many times to load each file.
+
+    :return: a dictionary with the best load time in seconds per format, plus the time it takes
+    to evaluate the first batch with each model (which for the binary format includes paging in the weights).
+    """
+    binPath = convert(path)
+    x = nn.NetVar(np.random.rand(1, 28 * 28))
+    results = {}
+
+    for name, p in [('gz', path), ('bin', binPath)]:
+        loads, firstCalls = [], []
+
+        for _ in range(repeat):
+            t = time.perf_counter()
+            model = loadModel(p)
+            loads.append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            model(x)
+            firstCalls.append(time.perf_counter() - t)
+
+        results[name] = {'load': min(loads), 'firstCall': min(firstCalls)}
+        print('{}: load: {:,.6f} sec. | first call: {:,.6f} sec.'.format(name, *results[name].values()))
+
+    return results
+
+
+def writeReference(path, outPrefix, size=256, seed=0):
+    """Write random inputs and a model's outputs for them, to check other implementations against nnkit's.
+
+    :param path: path to a model file (see loadModel).
+
+    :param outPrefix: the path to write to, without extension. '.inputs.npy' and '.outputs.npy' are appended.
+
+    :param size: how many inputs to write.
+
+    :param seed: seed for the inputs.
+
+    :return: the paths to the inputs and outputs, as (size, 784) and (size, 10) float32 arrays.
+    """
+    x = np.random.RandomState(seed).rand(size, 28 * 28).astype(nn.dtype)
+    paths = outPrefix + '.inputs.npy', outPrefix + '.outputs.npy'
+    np.save(paths[0], x)
+    np.save(paths[1], np.asarray(loadModel(path)(nn.NetVar(x)), dtype=nn.dtype))
+    return paths
+
+
+def _align(n):
+    return (n + alignment - 1) // alignment * alignment
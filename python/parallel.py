@@ -0,0 +1,258 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import multiprocessing as mp
+import contextlib
+import threading
+import nnkit as nn
+import numpy as np
+import io
+
+import training
+
+
+class DataParallel:
+    """Synchronous data-parallel gradients of a single model, over forked replica processes.
+
+    The model's parameters are moved into shared memory, so replicas always see the weights the optimizer
+    last stepped to, without copying them. Each step, a global batch is written to shared memory and split into
+    one shard per replica (this process computes the first shard). Replicas write their gradients, weighted
+    by the size of their shard, into their own row of a shared gradient matrix. Summing its rows (the all-reduce)
+    yields the gradient of the mean loss over the whole batch, which is set on the model's parameters so a
+    regular optimizer step applies it.
+
+    Processes are forked when entering the context and stopped when leaving it:
+
+        with DataParallel(net, params, 4, batchSize) as parallel:
+            loss = parallel.forwardBackward(x, y)
+            parallel.allReduce()
+            optimizer.step()
+
+    Replicas each run their own BLAS, so they are best combined with a single BLAS thread per process
+    (i.e.: OMP_NUM_THREADS=1).
+
+    Attributes:
+    . workers: the number of replicas, including this process.
+    """
+    def __init__(self, net, params, workers, batchSize, inputSize=28 * 28, classes=10):
+        """
+        :param net: a nn.FFN ending in a loss node.
+
+        :param params: the NetVars to compute gradients for (i.e.: the model's vars without the loss target).
+
+        :param workers: the number of replicas, including this process.
+
+        :param batchSize: the largest global batch size.
+
+        :param inputSize, classes: the size of examples and (one-hot) targets.
+        """
+        self.net, self.params, self.workers = net, params, workers
+        self.sizes = [p.data.size for p in params]
+        self.offsets = np.cumsum([0] + self.sizes)
+        self.x, self.y = _shared((batchSize, inputSize)), _shared((batchSize, classes))
+        self.grads = _shared((workers, self.offsets[-1]))
+        self.losses = _shared((workers,))
+        self.weights = _shared((self.offsets[-1],))
+        self.n = mp.get_context('fork').RawValue('i', 0)
+        self.processes = []
+
+    def __enter__(self):
+        # Move parameters into shared memory, in place of their private arrays:
+        for p, start, size in zip(self.params, self.offsets, self.sizes):
+            view = self.weights[start:start + size].reshape(p.data.shape)
+            view[...] = p.data
+            p.data = view
+
+        context = mp.get_context('fork')
+        self.start, self.done = context.Barrier(self.workers), context.Barrier(self.workers)
+
+        for i in range(1, self.workers):
+            process = context.Process(target=self._replica, args=(i,), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        return self
+
+    def __exit__(self, error, *args):
+        # A batch size of -1 tells replicas to exit. After an error, replicas may be waiting on either barrier:
+        if error is None and not self.start.broken:
+            self.n.value = -1
+            self.start.wait()
+        else:
+            self.start.abort()
+            self.done.abort()
+
+        for process in self.processes:
+            process.join()
+
+        self.processes.clear()
+
+        # Give parameters their own arrays back, so the shared memory can be released:
+        for p in self.params:
+            p.data = np.array(p.data)
+
+    def forwardBackward(self, x, y):
+        """Compute the loss and gradients of a global batch over all replicas.
+
+        :param x: a batch of examples.
+        :param y: their one-hot targets.
+        :return: the mean loss over the batch.
+        """
+        n = len(x)
+        self.x[:n], self.y[:n] = x, y
+        self.n.value = n
+        self.start.wait()
+        self._shard(0)
+        self.done.wait()
+        return np.sum(self.losses)
+
+    def allReduce(self):
+        """Sum the gradients of all replicas and set them on the model's parameters."""
+        grads = np.sum(self.grads, axis=0)
+
+        for p, start, size in zip(self.params, self.offsets, self.sizes):
+            p.g = grads[start:start + size].reshape(p.data.shape)
+
+    def _shard(self, i):
+        n, net = self.n.value, self.net
+        lo, hi = i * n // self.workers, (i + 1) * n // self.workers
+
+        if hi == lo:
+            self.grads[i], self.losses[i] = 0, 0
+            return
+
+        x, y = nn.NetVar(self.x[lo:hi]), net.topology[-1][1]
+        y.data = self.y[lo:hi]
+        loss = net(x)
+        net.back()
+
+        # Each shard's loss is a mean over the shard, so weigh it into a mean over the batch:
+        weight = (hi - lo) / n
+        self.losses[i] = loss.item() * weight
+
+        for p, start, size in zip(self.params, self.offsets, self.sizes):
+            np.multiply(p.g.ravel(), weight, out=self.grads[i, start:start + size])
+            p.reset()
+
+    def _replica(self, i):
+        try:
+            while True:
+                self.start.wait()
+
+                if self.n.value < 0:
+                    return
+
+                self._shard(i)
+                self.done.wait()
+        except threading.BrokenBarrierError:
+            pass
+        except BaseException:
+            self.start.abort()
+            self.done.abort()
+            raise
+
+
+def checkConvergence(trainingSet, validationSet, layers, batchSize, epochs, workers, learnRate=0.99, seed=0,
+                     tolerance=1e-3):
+    """Train the same model with a single process and with data parallelism and compare their stats.
+
+    Data parallelism only changes the order gradients are summed in, so stats should agree up to float rounding.
+
+    :param trainingSet, validationSet: see training.trainMNIST.
+
+    :param layers, batchSize: the model's hidden layers and global batch size.
+
+    :param epochs: how many epochs to train for.
+
+    :param workers: the number of data parallel replicas.
+
+    :param learnRate: the learn rate of the gradient descent optimizer.
+
+    :param seed: seed for both runs.
+
+    :param tolerance: the largest difference allowed between stats of both runs.
+
+    :return: a dictionary with the stats of both runs and the largest difference between them.
+    """
+    results = {}
+
+    for name, n in [('baseline', 1), ('parallel', workers)]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats, _ = training.trainMNIST(
+                trainingSet, validationSet, epochs, [layers], [batchSize], [(str(learnRate), lambda E, e: learnRate)],
+                keepBest=1, seed=seed, dataParallel=n
+            )
+
+        results[name] = next(iter(stats.values()))
+
+    difference = max(
+        float(np.max(np.abs(np.subtract(results['baseline'][e], results['parallel'][e]))))
+        for e in results['baseline']
+    )
+
+    results['difference'] = difference
+    print('max stats difference between 1 and {} workers over {} epochs: {:.2e}'.format(workers, epochs, difference))
+
+    if difference > tolerance:
+        raise AssertionError('data parallel training diverged from the baseline by {}.'.format(difference))
+
+    return results
+
+
+def benchmark(trainingSet, layers, batchSize, workers, steps=50, seed=0):
+    """Measure training throughput with 1 through n data parallel replicas.
+
+    :param trainingSet: see training.trainMNIST.
+
+    :param layers, batchSize: the model's hidden layers and global batch size.
+
+    :param workers: the largest number of replicas to measure.
+
+    :param steps: how many optimizer steps to time per number of replicas.
+
+    :param seed: seed for the model's initial weights.
+
+    :return: a dictionary of samples per second and speedup over 1 replica, per number of replicas.
+    """
+    results = {}
+
+    for n in range(1, workers + 1):
+        trainer = training.benchmarkTrainer(layers, batchSize, trainingSet, seed)
+
+        with DataParallel(trainer.net, trainer.optimizer.params, n, batchSize) if n > 1 else contextlib.nullcontext() \
+                as replicas:
+            seconds = training.timeSteps(trainer, steps, replicas)
+
+        results[n] = {'samplesPerSecond': steps * batchSize / seconds}
+        results[n]['speedup'] = results[n]['samplesPerSecond'] / results[1]['samplesPerSecond']
+        print('workers: {} | samples/s: {:,.0f} | speedup: {:,.2f}x'.format(n, *results[n].values()))
+
+    return results
+
+
+def _shared(shape):
+    # A zeroed float array in shared memory, inherited by forked processes:
+    buffer = mp.get_context('fork').RawArray('f', int(np.prod(shape)))
+    return np.frombuffer(buffer, dtype=nn.dtype).reshape(shape)
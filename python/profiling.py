@@ -0,0 +1,96 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import defaultdict
+from contextlib import contextmanager
+import resource
+import sys
+import time
+
+
+class Profiler:
+    """Opt-in timing of the phases of training (see training.trainMNIST).
+
+    Phases are timed as they run and summed per epoch into a record with the seconds spent in each phase,
+    training samples per second and peak memory. Records are stored in a model's stats under 'profile',
+    keyed by epoch, and passed to hooks.
+
+    Attributes:
+    . hooks: a list of callables taking (key, epoch, record), called after every epoch.
+    i.e.: to send records to an external collector.
+    """
+    def __init__(self, *hooks):
+        """
+        :param hooks: optional callables to add to hooks.
+        """
+        self.hooks = list(hooks)
+        self.times = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase, adding to any time already spent in it this epoch.
+
+        :param name: the phase's name. i.e.: 'forward'.
+        """
+        t = time.perf_counter()
+        yield
+        self.times[name] += time.perf_counter() - t
+
+    def add(self, name, seconds):
+        """Add time spent in a phase that was measured elsewhere."""
+        self.times[name] += seconds
+
+    def epoch(self, key, epoch, samples, trainingPhases=('batch', 'forward', 'backward', 'step')):
+        """Close an epoch: make its record, pass it to hooks and start timing the next one.
+
+        :param key: the model's key in the stats dictionary.
+
+        :param epoch: the epoch.
+
+        :param samples: how many training examples the epoch went through.
+
+        :param trainingPhases: the phases samples per second are computed over.
+
+        :return: a dictionary of seconds per phase, plus 'samplesPerSecond' and 'peakMemoryMB'
+        (the peak resident set size of the process so far).
+        """
+        record = dict(self.times)
+        trainingTime = sum(self.times[p] for p in trainingPhases)
+        record['samplesPerSecond'] = samples / trainingTime if trainingTime else 0.
+        record['peakMemoryMB'] = peakMemory()
+        self.times.clear()
+
+        for hook in self.hooks:
+            hook(key, epoch, record)
+
+        return record
+
+
+def peakMemory():
+    """Peak resident set size of the current process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes:
+    return peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
@@ -0,0 +1,223 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import nnkit as nn
+import numpy as np
+import json
+import os
+
+import engine
+import modelio
+import testing
+
+"""Post-training int8 quantization, for storage only.
+
+Quantized model files are about 4 times smaller than float32 ones, but models are dequantized to float32 to be
+evaluated (see load): int8 makes inference neither faster nor lighter in memory.
+
+Quantized model file ('.qmodel.npz'):
+
+. header: utf-8 json list of {'op': name, 'args': [...]}, like nnkit's gzipped json, except that array arguments
+  are replaced by {'array': name}, the name of the array holding them in the archive.
+. arrays: int8 weights and float32 per channel scales of quantized layers, float32 values of any other NetVar.
+"""
+levels = 127
+
+
+class QuantizedMultiply(nn.NetOp):
+    """Multiplication by int8 weights with per channel (column) scales.
+
+    y = (xq)s
+
+    This op is how quantized layers are stored. numpy converts q to float on every call, so it's slower than
+    a float Multiply: dequantize a topology (as load does) to evaluate it. It has no backward pass.
+    """
+    def __init__(self, x, q, s):
+        """
+        :param x: NetVar: input.
+
+        :param q: int8 array: quantized weights.
+
+        :param s: float32 array: the scale of each column in q, so that w ≈ qs.
+        """
+        super().__init__(
+            (x.data @ q) * s,
+            x
+        )
+
+
+def quantize(topology):
+    """Quantize the weights of all Multiply layers to int8 with a scale per output channel.
+
+    Quantization is symmetric: for each column j in w, s_j = max(|w_j|)/127 and q_j = round(w_j/s_j).
+    All other layers are kept as they are.
+
+    :param topology: a list of tuples, as in nn.FFN.topology.
+    :return: a list of tuples which can be passed to nn.FFN.
+    """
+    quantized = []
+
+    for n in topology:
+        if n[0] is nn.Multiply:
+            w = n[1].data
+            s = np.max(np.abs(w), axis=0, keepdims=True) / levels
+            s[s == 0] = 1.
+            q = np.clip(np.rint(w / s), -levels, levels).astype(np.int8)
+            quantized.append((QuantizedMultiply, q, s.astype(nn.dtype)))
+        else:
+            quantized.append(n)
+
+    return quantized
+
+
+def dequantize(topology):
+    """Replace quantized layers by float Multiply layers with the weights they approximate (qs).
+
+    Quantization then only saves storage: the model evaluates as fast as the float one, with the accuracy of the
+    quantized one.
+
+    :param topology: a list of tuples, as returned by quantize.
+    :return: a list of tuples which can be passed to nn.FFN.
+    """
+    return [
+        (nn.Multiply, nn.NetVar(n[1].astype(nn.dtype) * n[2])) if n[0] is QuantizedMultiply else n
+        for n in topology
+    ]
+
+
+def save(topology, path):
+    """Save a quantized topology (list of tuples) to a compressed archive.
+
+    :param topology: a list of tuples, as returned by quantize.
+    :param path: the path to save to, without extension. '.qmodel.npz' is appended.
+    """
+    header, arrays = [], {}
+
+    def arg(a):
+        if type(a) is nn.NetVar:
+            a = a.data
+
+        if type(a) is not np.ndarray:
+            return a
+
+        name = 'a{}'.format(len(arrays))
+        arrays[name] = a
+        return {'array': name}
+
+    for n in topology:
+        header.append({'op': n[0].__name__, 'args': [arg(a) for a in n[1:]]})
+
+    with open(path + '.qmodel.npz', 'wb') as file:
+        np.savez_compressed(file, header=np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8), **arrays)
+
+
+def load(path, dequantized=True):
+    """Load a quantized topology (list of tuples) from a compressed archive.
+
+    :param path: the path to load from, without extension.
+    :param dequantized: whether to dequantize the topology for fast evaluation (see dequantize).
+    :return: a list of tuples which can be passed to nn.FFN.
+    """
+    with np.load(path + '.qmodel.npz') as archive:
+        header = json.loads(bytes(archive['header']).decode('utf-8'))
+
+        def arg(op, a):
+            if type(a) is not dict:
+                return a
+
+            # Quantized layers take raw arrays, all other layers NetVars:
+            array = archive[a['array']]
+            return array if op is QuantizedMultiply else nn.NetVar(array)
+
+        topology = []
+
+        for d in header:
+            op = QuantizedMultiply if d['op'] == QuantizedMultiply.__name__ else getattr(nn, d['op'])
+            topology.append((op, *[arg(op, a) for a in d['args']]))
+
+        return dequantize(topology) if dequantized else topology
+
+
+def convert(path):
+    """Quantize a saved model.
+
+    :param path: path to a '.model.gz' or '.model.bin' file.
+    :return: the path to the quantized '.qmodel.npz' file, next to the original.
+    """
+    model = modelio.loadModel(path)
+    path = path.rsplit('.model.', 1)[0]
+    save(quantize(model.topology), path)
+    return path + '.qmodel.npz'
+
+
+def report(path, testSet, batchSizes=(1, 64, 1024), repeat=20):
+    """Compare a saved model against its quantized version.
+
+    Sizes are compared against the float32 binary format (see modelio), which stores weights uncompressed.
+    The quantized model is evaluated dequantized (see dequantize), so latencies should be about the same.
+
+    :param path: path to a '.model.gz' or '.model.bin' file. It is quantized (and converted to binary if needed)
+    next to the original.
+
+    :param testSet: a 2-tuple with held out examples and labels (see testing.testMNIST).
+
+    :param batchSizes: batch sizes to time inference with.
+
+    :param repeat: how many times to evaluate each batch size. The best time is kept.
+
+    :return: a dictionary with the size, test accuracy and latency per batch size of each model,
+    as well as the accuracy delta and size and latency ratios (float / quantized) between them.
+    """
+    quantizedPath = convert(path)
+    floatPath = path if path.endswith('.model.bin') else modelio.convert(path)
+    models = {'float': modelio.loadModel(floatPath), 'int8': modelio.loadModel(quantizedPath)}
+    results = {}
+
+    for name, p in [('float', floatPath), ('int8', quantizedPath)]:
+        model = models[name]
+        latency = engine.latency(model, testSet[0], batchSizes, repeat)
+
+        results[name] = {
+            'size': os.path.getsize(p),
+            'accuracy': testing.testMNIST(model, testSet),
+            'latency': latency
+        }
+
+    results['accuracyDelta'] = results['int8']['accuracy'] - results['float']['accuracy']
+    results['sizeRatio'] = results['float']['size'] / results['int8']['size']
+    results['latencyRatio'] = {b: results['float']['latency'][b] / results['int8']['latency'][b] for b in batchSizes}
+
+    for name in ['float', 'int8']:
+        print('{}: size: {:,} bytes | MNIST test accuracy: {:,.2%} | latency: {}'.format(
+            name, results[name]['size'], results[name]['accuracy'],
+            ' '.join('b{}: {:,.6f} sec.'.format(b, t) for b, t in results[name]['latency'].items())
+        ))
+
+    print('accuracy delta: {:+,.2%} | size: {:,.2f}x smaller | latency: {}'.format(
+        results['accuracyDelta'], results['sizeRatio'],
+        ' '.join('b{}: {:,.2f}x'.format(b, r) for b, r in results['latencyRatio'].items())
+    ))
+
+    return results
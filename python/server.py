@@ -0,0 +1,340 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from concurrent.futures import Future
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import nnkit as nn
+import numpy as np
+import cv2 as cv
+
+import testing
+import modelio
+
+
+class MicroBatcher:
+    """Coalesce concurrent prediction requests into batches evaluated by a single thread.
+
+    Requests wait at most maxWait seconds for others to join their batch, so under load the model
+    runs on batches of up to maxBatch rows, while a lone request only pays maxWait in latency.
+
+    Attributes:
+    . model: the model batches are evaluated with. It can be replaced at any time (see swap),
+    batches already running finish on the previous model.
+    """
+    def __init__(self, model, maxBatch=256, maxWait=0.002):
+        """
+        :param model: the model to predict with (i.e.: a nn.FFN).
+        :param maxBatch: the maximum number of rows in a batch. A single larger request still runs as one batch.
+        :param maxWait: the maximum time (in seconds) the first request of a batch waits for others.
+        """
+        self.model = model
+        self.maxBatch, self.maxWait = maxBatch, maxWait
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=10000)
+        self.counters = {'requests': 0, 'rows': 0, 'batches': 0, 'swaps': 0, 'errors': 0}
+        self.start = time.time()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, rows):
+        """Queue rows for prediction.
+
+        :param rows: a (n, 784) array of model inputs.
+        :return: a Future resolving to the (n, 10) model output for rows.
+        """
+        future = Future()
+        self.requests.put((rows, future, time.perf_counter()))
+        return future
+
+    def swap(self, model):
+        """Replace the model used for subsequent batches."""
+        self.model = model
+
+        with self.lock:
+            self.counters['swaps'] += 1
+
+    def stats(self):
+        """Get latency and throughput counters.
+
+        :return: a dictionary with request, row and batch counts, mean batch size, rows per second since start
+        and percentiles of recent request latencies, in seconds.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            latencies = np.array(self.latencies)
+
+        uptime = time.time() - self.start
+        stats['uptime'] = uptime
+        stats['meanBatch'] = stats['rows'] / max(stats['batches'], 1)
+        stats['rowsPerSecond'] = stats['rows'] / uptime
+
+        for p in 50, 90, 99:
+            stats['p{}'.format(p)] = float(np.percentile(latencies, p)) if len(latencies) else None
+
+        return stats
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0][0])
+            deadline = time.perf_counter() + self.maxWait
+
+            # Wait for more requests until the batch is full or the first one has waited long enough:
+            while size < self.maxBatch:
+                timeout = deadline - time.perf_counter()
+
+                try:
+                    request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+
+                batch.append(request)
+                size += len(request[0])
+
+            try:
+                out = self.model(nn.NetVar(np.concatenate([r[0] for r in batch])))
+            except Exception as e:
+                with self.lock:
+                    self.counters['errors'] += len(batch)
+
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+                continue
+
+            i, now = 0, time.perf_counter()
+
+            with self.lock:
+                self.counters['requests'] += len(batch)
+                self.counters['rows'] += size
+                self.counters['batches'] += 1
+                self.latencies.extend(now - t for _, _, t in batch)
+
+            for rows, future, _ in batch:
+                future.set_result(out[i:i + len(rows)])
+                i += len(rows)
+
+
+class ModelWatcher:
+    """Hot-swap a batcher's model when its file changes on disk."""
+    def __init__(self, batcher, modelPath, interval=1.):
+        """
+        :param batcher: a MicroBatcher.
+        :param modelPath: path to a '.model.gz' or '.model.bin' file (see modelio.loadModel).
+        :param interval: how often (in seconds) to check the file's modification time. 0 disables watching.
+        """
+        self.batcher, self.modelPath = batcher, modelPath
+        self.mtime = os.path.getmtime(modelPath)
+
+        if interval:
+            threading.Thread(target=self._run, args=(interval,), daemon=True).start()
+
+    def reload(self, modelPath=None):
+        """Load a model and swap it in. The current model keeps serving while the new one loads.
+
+        :param modelPath: optional new path to watch and load from.
+        """
+        modelPath = modelPath or self.modelPath
+        mtime = os.path.getmtime(modelPath)
+        model = modelio.loadModel(modelPath)
+        # Only once loaded, so a failed load is retried:
+        self.modelPath, self.mtime = modelPath, mtime
+        self.batcher.swap(model)
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+
+            try:
+                if os.path.getmtime(self.modelPath) != self.mtime:
+                    self.reload()
+            except Exception as e:
+                # Keep serving the current model if the new file is missing or only partially written
+                # (i.e.: EOFError from a truncated .model.gz), and retry on the next check:
+                print('model reload failed: {}: {}'.format(type(e).__name__, e))
+
+
+class Handler(BaseHTTPRequestHandler):
+    """HTTP endpoints:
+
+    . POST /predict: json {'inputs': [[784 floats in [0, 1]], ...]}, responds with
+    {'predictions': [...], 'confidences': [...]}.
+    . POST /image: an encoded image (png, jpg...) as the request body, responds with
+    {'digits': [{'prediction', 'confidence', 'box'}, ...]} (see testing.predictDigits).
+    . POST /reload: optional json {'model': path}, reloads the model (or loads a new one) without downtime.
+    . GET /stats: latency and throughput counters (see MicroBatcher.stats).
+    """
+    server_version = 'digits'
+    local = threading.local()
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._respond(200, self.server.batcher.stats())
+        else:
+            self._respond(404, {'error': 'not found'})
+
+    def do_POST(self):
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            if self.path == '/predict':
+                rows = np.array(json.loads(body)['inputs'], dtype=nn.dtype, ndmin=2)
+
+                if rows.shape[1] != 28 * 28:
+                    raise ValueError('inputs must have 784 values per row.')
+
+                out = self.server.batcher.submit(rows).result()
+                self._respond(200, {
+                    'predictions': np.argmax(out, axis=1).tolist(),
+                    'confidences': np.max(out, axis=1).tolist()
+                })
+
+            elif self.path == '/image':
+                self._respond(200, {'digits': [d._asdict() for d in self._predictImage(body)]})
+
+            elif self.path == '/reload':
+                path = json.loads(body).get('model') if body else None
+                self.server.watcher.reload(path)
+                self._respond(200, {'model': self.server.watcher.modelPath})
+
+            else:
+                self._respond(404, {'error': 'not found'})
+
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self._respond(400, {'error': str(e)})
+        except Exception as e:
+            # Model or OpenCV errors: the client still gets a response:
+            self._respond(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+
+    def _predictImage(self, body):
+        # Same pixels testing.testCustom reads images as, so results match:
+        img = cv.imdecode(np.frombuffer(body, np.uint8), testing.imreadFlags)
+
+        if img is None:
+            raise ValueError('could not decode image.')
+
+        # Preprocessing runs in the request's thread, only the forward pass is batched:
+        if not hasattr(self.local, 'context'):
+            self.local.context = testing.ContourContext()
+
+        boxes, binary = testing.detectDigits(img, self.local.context)
+
+        if not boxes:
+            return []
+
+        out = self.server.batcher.submit(testing.normalizeROIs(binary, boxes)).result()
+
+        return [
+            testing.Digit(int(p), float(c), box)
+            for p, c, box in zip(np.argmax(out, axis=1), np.max(out, axis=1), boxes)
+        ]
+
+    def _respond(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address:
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Same attributes HTTPServer sets up, which the request handler expects:
+        UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address, 0
+
+
+def makeServer(modelPath, address, maxBatch=256, maxWait=0.002, watch=1., verbose=False):
+    """Create an inference server.
+
+    :param modelPath: path to a '.model.gz' or '.model.bin' file (see modelio.loadModel).
+
+    :param address: a (host, port) 2-tuple to serve HTTP over TCP, or a path to serve HTTP over a unix socket.
+
+    :param maxBatch, maxWait: see MicroBatcher.
+
+    :param watch: how often (in seconds) to check the model file for changes. 0 disables hot-swapping
+    on file changes (POST /reload still works).
+
+    :param verbose: whether to log every request.
+
+    :return: a server. Call serve_forever() on it to start serving.
+    """
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.remove(address)
+
+        server = ThreadingUnixHTTPServer(address, Handler)
+    else:
+        server = ThreadingHTTPServer(address, Handler)
+
+    server.batcher = MicroBatcher(modelio.loadModel(modelPath), maxBatch, maxWait)
+    server.watcher = ModelWatcher(server.batcher, modelPath, watch)
+    server.verbose = verbose
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve digit predictions over HTTP.')
+    parser.add_argument('model', help='path to a .model.gz or .model.bin file.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', default=None, help='serve over a unix socket at this path instead of tcp.')
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-wait', type=float, default=0.002, help='seconds.')
+    parser.add_argument('--watch', type=float, default=1., help='seconds between model file checks, 0 to disable.')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = makeServer(
+        args.model, args.unix or (args.host, args.port), args.max_batch, args.max_wait, args.watch, args.verbose
+    )
+
+    print('serving {} on {}'.format(args.model, server.server_address))
+    server.serve_forever()
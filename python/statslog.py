@@ -0,0 +1,213 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import fcntl
+import json
+import time
+import os
+
+"""Append-only training stats log.
+
+The log is a json lines file with one record per line: {'model': key, 'epoch': e, ...}, where the remaining
+entries are 'stats' ((trainLoss, valLoss, valAccuracy), as in training.trainMNIST), 'profile' (see profiling.Profiler)
+or 'pruned' (in records without an epoch). Next to it, an index file ('<log>.idx') holds one
+'<offset> <length> <key>' line per record, so a model's records can be read without reading the whole log.
+
+Records are appended under an exclusive lock, so several processes can write to the same log.
+"""
+
+
+class StatsLog:
+    """Writer for a stats log."""
+    def __init__(self, path):
+        """
+        :param path: path to the log. It is created if it doesn't exist and appended to otherwise.
+        """
+        self.path = path
+
+    def append(self, key, epoch=None, **entries):
+        """Append a record.
+
+        :param key: the model's key.
+        :param epoch: the epoch the record is for, or None for records about the whole model.
+        :param entries: the record's entries. i.e.: stats=(0.1, 0.2, 97.).
+        """
+        line = (json.dumps(dict(model=key, epoch=epoch, **entries)) + '\n').encode('utf-8')
+
+        with open(self.path, 'ab') as log, open(self.path + '.idx', 'ab') as index:
+            fcntl.flock(log, fcntl.LOCK_EX)
+
+            try:
+                offset = log.seek(0, os.SEEK_END)
+                log.write(line)
+                log.flush()
+                index.write('{} {} {}\n'.format(offset, len(line), key).encode('utf-8'))
+            finally:
+                fcntl.flock(log, fcntl.LOCK_UN)
+
+    def clear(self):
+        """Empty the log and its index, i.e.: to start a new session."""
+        with open(self.path, 'ab') as log:
+            fcntl.flock(log, fcntl.LOCK_EX)
+
+            try:
+                log.truncate(0)
+                open(self.path + '.idx', 'wb').close()
+            finally:
+                fcntl.flock(log, fcntl.LOCK_UN)
+
+
+def models(path):
+    """List the models in a stats log.
+
+    :param path: path to the log.
+    :return: a list of model keys, in the order they first appear.
+    """
+    return list(dict.fromkeys(key for _, _, _, key in _index(path)))
+
+
+def readModel(path, key):
+    """Read the records of a model.
+
+    :param path: path to the log.
+    :param key: the model's key.
+
+    :return: a dictionary in the format of the stats json files written by digits.train:
+    {str(epoch): stats, ...}, plus 'pruned' and 'profile' ({str(epoch): record}) if they were logged.
+    Later records for an epoch (i.e.: from a resumed session) replace earlier ones.
+    """
+    stats = {}
+
+    with open(path, 'rb') as log:
+        for _, offset, length, k in _index(path):
+            if k == key:
+                _merge(stats, _read(log, offset, length))
+
+    return stats
+
+
+def readAll(path):
+    """Read the records of all models, reading the log once.
+
+    :param path: path to the log.
+    :return: a dictionary of stats (see readModel) per model key.
+    """
+    allStats = {}
+
+    with open(path, 'rb') as log:
+        for line in log:
+            if line.endswith(b'\n'):
+                record = json.loads(line.decode('utf-8'))
+                _merge(allStats.setdefault(record['model'], {}), record)
+
+    return allStats
+
+
+def follow(path, key, interval=1.):
+    """Tail a model's records while they are being written.
+
+    :param path: path to the log. It doesn't need to exist yet.
+    :param key: the model's key.
+    :param interval: how often (in seconds) to check for new records.
+
+    :return: a generator of the model's stats (see readModel), yielded once at first and
+    again whenever new records for it are appended. The same dictionary is updated and yielded each time.
+    """
+    stats, start = {}, 0
+    yield stats
+
+    while True:
+        changed = False
+
+        if os.path.exists(path + '.idx'):
+            with open(path, 'rb') as log:
+                for start, offset, length, k in _index(path, start):
+                    if k == key:
+                        _merge(stats, _read(log, offset, length))
+                        changed = True
+
+        if changed:
+            yield stats
+
+        time.sleep(interval)
+
+
+def importJSON(jsonPath, path):
+    """Convert a stats json file, as written by digits.train, to a stats log.
+
+    :param jsonPath: path to the json file.
+    :param path: path to the log to append to.
+    """
+    with open(jsonPath, 'rt') as file:
+        allStats = json.load(file)
+
+    log = StatsLog(path)
+
+    for key, stats in allStats.items():
+        profile = stats.get('profile', {})
+
+        for epoch in sorted([e for e in stats if e.isdigit()], key=int):
+            entries = {'stats': stats[epoch]}
+
+            if epoch in profile:
+                entries['profile'] = profile[epoch]
+
+            log.append(key, int(epoch), **entries)
+
+        if 'pruned' in stats:
+            log.append(key, pruned=stats['pruned'])
+
+
+def _index(path, start=0):
+    # Yield (end, offset, length, key) for each index line, where end is the position after the line:
+    with open(path + '.idx', 'rb') as index:
+        index.seek(start)
+
+        for line in index:
+            # Skip a line still being written:
+            if not line.endswith(b'\n'):
+                break
+
+            start += len(line)
+            offset, length, key = line.decode('utf-8').rstrip('\n').split(' ', 2)
+            yield start, int(offset), int(length), key
+
+
+def _read(log, offset, length):
+    log.seek(offset)
+    return json.loads(log.read(length).decode('utf-8'))
+
+
+def _merge(stats, record):
+    epoch = record.get('epoch')
+
+    if 'stats' in record:
+        stats[str(epoch)] = record['stats']
+
+    if 'profile' in record:
+        stats.setdefault('profile', {})[str(epoch)] = record['profile']
+
+    if 'pruned' in record:
+        stats['pruned'] = record['pruned']
@@ -24,9 +24,14 @@
 # SOFTWARE.
 
 import matplotlib.pyplot as plt
+import multiprocessing as mp
 import numpy as np
+import hashlib
 import json
 import re
+import os
+
+import statslog
 
 
 def markEpoch(epoch, epochs, stats, ax1, ax2, best):
@@ -37,19 +42,19 @@ def markEpoch(epoch, epochs, stats, ax1, ax2, best):
 
     ax2.scatter([epoch], [stat[2]], s=size, alpha=alpha, color=(109 / 255, 204 / 255, 218 / 255))
     ax2.annotate(
-        s='{:,.2f} {}'.format(stat[2], '*BEST*' if best else ""),
+        '{:,.2f} {}'.format(stat[2], '*BEST*' if best else ""),
         xy=(epoch + 0.005, stat[2] + 0.005), fontsize=7
     )
 
     ax1.scatter([epoch], [stat[1]], s=size, alpha=alpha, color=(255 / 255, 158 / 255, 74 / 255))
     ax1.annotate(
-        s='{:,.3f}'.format(stat[1]),
+        '{:,.3f}'.format(stat[1]),
         xy=(epoch + 0.005, stat[1] + 0.005), fontsize=7
     )
 
     ax1.scatter([epoch], [stat[0]], s=size  , alpha=alpha, color=(237 / 255, 102 / 255, 93 / 255))
     ax1.annotate(
-        s='{:,.3f}'.format(stat[0]),
+        '{:,.3f}'.format(stat[0]),
         xy=(epoch + 0.005, stat[0] + 0.005), fontsize=7
     )
 
@@ -60,24 +65,200 @@ def markEpoch(epoch, epochs, stats, ax1, ax2, best):
     ax1.axvline(x=epoch, linewidth=0.5, alpha=alpha)
 
 
+def loadAllStats(statsPath):
+    """Load the stats of all models.
+
+    :param statsPath: see loadStats.
+    :return: a dictionary of stats per model key.
+    """
+    if statsPath.endswith('.jsonl'):
+        return statslog.readAll(statsPath)
+
+    with open(statsPath, 'rt') as file:
+        return json.load(file)
+
+
+def loadStats(key, statsPath):
+    """Load the stats of a model.
+
+    :param key: the model's key.
+    :param statsPath: path to a stats json file (as written by digits.train) or a stats log (see statslog),
+    if it ends in '.jsonl'. Only the model's records are read from a stats log.
+
+    :return: the model's stats, as a dictionary of stats per (string) epoch.
+    """
+    if statsPath.endswith('.jsonl'):
+        return statslog.readModel(statsPath, key)
+
+    with open(statsPath, 'rt') as file:
+        return json.load(file)[key]
+
+
 def plotStats(key, statsPath, epochs, extraMarkEpochs, save):
     """Plot training / validation loss plus validation accuracy for a model"""
-    with open(statsPath, 'rt') as file:
-        stats = json.load(file)[key]
+    figure = plt.figure(figsize=(9, 6))
+    drawStats(figure, key, loadStats(key, statsPath), epochs, extraMarkEpochs)
 
-    match = re.match(r"\(\d+, \((.*)\), (\d+), (.*)\).*", key)
-    topology = match.group(1).replace(" ", "-").replace(",", "")
-    batchSize = match.group(2)
-    learnRate = match.group(3).replace("'", "")
+    if save:
+        plt.savefig(
+            'plot-t{}-b{}-l{}.svg'.format(*_params(key)),
+            format='svg', dpi=1200, transparent=True
+        )
+    else:
+        plt.show(block=True)
+
+
+def followStats(key, logPath, epochs, interval=5.):
+    """Plot a model's stats and keep replotting them as new epochs are logged.
+
+    :param key: the model's key.
+    :param logPath: path to a stats log being written by training.trainMNIST (see statslog).
+    :param epochs: the total number of epochs the model trains for.
+    :param interval: how often (in seconds) to check for new epochs.
+    """
+    plt.ion()
+    figure = plt.figure(figsize=(9, 6))
+
+    for stats in statslog.follow(logPath, key, interval):
+        if any(e.isdigit() for e in stats):
+            figure.clf()
+            drawStats(figure, key, stats, epochs, [])
+
+        # Redraw and wait:
+        plt.pause(0.1)
+
+        if not plt.fignum_exists(figure.number):
+            break
+
+
+def plotReport(statsPath, outDir, epochs, pattern=None, workers=None, format='png', dpi=150):
+    """Plot all models in a stats file, plus a leaderboard comparing them, without a display.
 
-    epochRange = list(range(1, epochs+1))
+    Plots are rendered in worker processes with a non-interactive backend. A hash of what goes into each plot
+    is kept in outDir ('report-cache.json'), so re-runs skip plots whose stats didn't change.
+
+    :param statsPath: path to a stats json file or stats log (see loadStats).
+
+    :param outDir: directory to write plots to.
+
+    :param epochs: the total number of epochs models were trained for.
+
+    :param pattern: an optional regular expression. Only models with a matching key are plotted.
+
+    :param workers: how many processes to render with. Defaults to the number of cores.
+
+    :param format: the file format of plots (i.e.: 'png', 'svg', 'pdf').
+
+    :param dpi: the resolution of plots in raster formats.
+
+    :return: a 2-tuple with lists of the paths that were rendered and the paths skipped because they were up to date.
+    Models without any epoch stats (i.e.: aborted in their first epoch) are left out.
+    """
+    allStats = {
+        key: {e: v for e, v in stats.items() if e.isdigit() or e == 'pruned'}
+        for key, stats in loadAllStats(statsPath).items()
+        if not pattern or re.search(pattern, key)
+    }
+
+    os.makedirs(outDir, exist_ok=True)
+    cachePath = os.path.join(outDir, 'report-cache.json')
+
+    if os.path.exists(cachePath):
+        with open(cachePath, 'rt') as file:
+            cache = json.load(file)
+    else:
+        cache = {}
+
+    tasks = [('leaderboard', allStats, epochs, os.path.join(outDir, 'leaderboard.' + format), format, dpi)] + [
+        (key, stats, epochs, os.path.join(outDir, 'plot-t{}-b{}-l{}.{}'.format(*_params(key), format)), format, dpi)
+        for key, stats in allStats.items()
+        # Runs aborted before their first epoch have nothing to plot:
+        if any(e.isdigit() for e in stats)
+    ]
+
+    digests = {
+        task[3]: hashlib.sha256(json.dumps(task, sort_keys=True).encode('utf-8')).hexdigest()
+        for task in tasks
+    }
+
+    skipped = [t[3] for t in tasks if cache.get(t[3]) == digests[t[3]] and os.path.exists(t[3])]
+    tasks = [t for t in tasks if t[3] not in skipped]
+    rendered = []
+
+    if tasks:
+        # Keep the plots that were rendered even if another one fails:
+        try:
+            with mp.Pool(workers, _initWorker) as pool:
+                for path in pool.imap_unordered(_render, tasks):
+                    rendered.append(path)
+                    cache[path] = digests[path]
+        finally:
+            with open(cachePath, 'wt') as file:
+                json.dump(cache, file)
+
+    return rendered, skipped
+
+
+def drawLeaderboard(figure, allStats, epochs):
+    """Draw the highest validation accuracy of each model, ranked, on a figure.
+
+    :param allStats: a dictionary of stats per model key.
+    :param epochs: the total number of epochs models were trained for.
+    """
+    best = []
+
+    for key, stats in allStats.items():
+        accuracies = [(stats[str(e)][2], e) for e in range(1, epochs + 1) if str(e) in stats]
+
+        if accuracies:
+            accuracy, epoch = max(accuracies)
+            best.append((accuracy, epoch, key, 'pruned' in stats))
+
+    best.sort()
+    accuracies = [b[0] for b in best]
+
+    ax = figure.add_subplot(1, 1, 1)
+    ax.spines["top"].set_visible(False)
+    ax.spines["right"].set_visible(False)
+    bars = ax.barh(range(len(best)), accuracies, color=(109 / 255, 204 / 255, 218 / 255))
+
+    for bar, (accuracy, epoch, key, pruned) in zip(bars, best):
+        if pruned:
+            bar.set_alpha(0.4)
+
+        ax.annotate(
+            '{:,.2f}% (epoch {}){}'.format(accuracy, epoch, ' pruned' if pruned else ''),
+            xy=(accuracy, bar.get_y() + bar.get_height() / 2), xytext=(3, 0), textcoords='offset points',
+            va='center', fontsize=7
+        )
+
+    ax.set_yticks(range(len(best)))
+    ax.set_yticklabels(
+        ['t{} | b{} | l{}'.format(*_params(b[2])) for b in best], fontsize=7
+    )
+
+    if accuracies:
+        ax.set_xlim(min(accuracies) - 0.5, max(accuracies) + 0.5)
+
+    ax.set_xlabel('highest validation accuracy (%)')
+    ax.set_title('Digits Classifier Leaderboard\n', fontsize=10)
+    figure.tight_layout()
+
+
+def drawStats(figure, key, stats, epochs, extraMarkEpochs):
+    """Draw training / validation loss plus validation accuracy for a model on a figure.
+
+    Only epochs present in stats are drawn, so partial (in progress or pruned) runs can be plotted too.
+    """
+    topology, batchSize, learnRate = _params(key)
+
+    epochRange = [e for e in range(1, epochs+1) if str(e) in stats]
     trainLoss = [stats[str(e)][0] for e in epochRange]
     valLoss = [stats[str(e)][1] for e in epochRange]
     valAccu = [stats[str(e)][2] for e in epochRange]
-    lowValLoss = [np.argmin(valLoss) + 1], [np.min(valLoss)]
-    highestValAccu = np.argmax(valAccu) + 1
+    lowValLoss = [epochRange[np.argmin(valLoss)]], [np.min(valLoss)]
+    highestValAccu = epochRange[np.argmax(valAccu)]
 
-    figure = plt.figure(figsize=(9, 6))
     ax = figure.add_subplot(1, 1, 1)
     ax.set_xlim(1, epochs)
     ax.set_xlabel('epochs')
@@ -101,7 +282,7 @@ def plotStats(key, statsPath, epochs, extraMarkEpochs, save):
 
     ax.scatter(*lowValLoss, s=120, alpha=0.5, color=(255 / 255, 158 / 255, 74 / 255))
     ax.annotate(
-        s='{:,.3f} -LOWEST-'.format(lowValLoss[1][0]),
+        '{:,.3f} -LOWEST-'.format(lowValLoss[1][0]),
         xy=(lowValLoss[0][0] + 0.005, lowValLoss[1][0] + 0.005), fontsize=7
     )
 
@@ -124,16 +305,36 @@ def plotStats(key, statsPath, epochs, extraMarkEpochs, save):
         loc='lower center', frameon=False, bbox_to_anchor=(0, 1, 1., 1), ncol=3
     )
 
-    plt.title('Digits Classifier Stats:\ntopology:{} | batch size: {} | learn rate: {}\n\n'.format(
+    ax2.set_title('Digits Classifier Stats:\ntopology:{} | batch size: {} | learn rate: {}\n\n'.format(
         topology, batchSize, learnRate
     ), fontsize=10)
 
-    plt.tight_layout()
+    figure.tight_layout()
 
-    if save:
-        plt.savefig(
-            'plot-t{}-b{}-l{}.svg'.format(topology, batchSize, learnRate),
-            format='svg', dpi=1200, transparent=True
-        )
+
+def _params(key):
+    # (topology, batch size, learn rate) of a model key, formatted for titles and file names:
+    match = re.match(r"\(\d+, \((.*)\), (\d+), (.*)\).*", key)
+    topology = match.group(1).replace(" ", "-").replace(",", "")
+    batchSize = match.group(2)
+    learnRate = match.group(3).replace("'", "")
+    return topology, batchSize, learnRate
+
+
+def _initWorker():
+    plt.switch_backend('Agg')
+
+
+def _render(task):
+    key, stats, epochs, path, format, dpi = task
+
+    if key == 'leaderboard':
+        figure = plt.figure(figsize=(9, max(3., 0.3 * len(stats) + 1)))
+        drawLeaderboard(figure, stats, epochs)
     else:
-        plt.show(block=True)
+        figure = plt.figure(figsize=(9, 6))
+        drawStats(figure, key, stats, epochs, [])
+
+    figure.savefig(path, format=format, dpi=dpi, transparent=True)
+    plt.close(figure)
+    return path
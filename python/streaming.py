@@ -0,0 +1,252 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2018 Federico Saldarini
+# https://www.linkedin.com/in/federicosaldarini
+# https://github.com/saldavonschwartz
+# https://0xfede.io
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import OrderedDict, namedtuple
+import nnkit as nn
+import numpy as np
+import cv2 as cv
+import glob
+import hashlib
+import os
+import time
+
+import testing
+import bulk
+
+"""The result of a frame of a stream:
+. index: the index of the frame in the stream.
+. digits: a list of testing.Digit found in the frame.
+. skipped: whether the frame was skipped for being the same as the last processed one.
+. reused: how many digits were reused from the last processed frame because their region didn't change.
+. latency: seconds it took to process the frame.
+. hitRate: the fraction of prediction cache lookups so far which were hits.
+"""
+FrameResult = namedtuple('FrameResult', ['index', 'digits', 'skipped', 'reused', 'latency', 'hitRate'])
+
+
+class PredictionCache:
+    """A bounded LRU cache of predictions, keyed by a hash of normalized 28x28 ROIs.
+
+    Attributes:
+    . hits, misses: how many lookups found and didn't find a prediction.
+    """
+    def __init__(self, maxSize=4096):
+        """
+        :param maxSize: how many predictions to keep. The least recently used ones are evicted first.
+        """
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def key(roi):
+        """Hash a normalized ROI.
+
+        :param roi: a row of testing.normalizeROIs.
+        :return: a 16 byte digest of the ROI.
+        """
+        return hashlib.blake2b(np.ascontiguousarray(roi).tobytes(), digest_size=16).digest()
+
+    @property
+    def hitRate(self):
+        """The fraction of lookups which were hits."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def get(self, key):
+        """Look up a prediction.
+
+        :param key: a ROI hash (see key).
+        :return: the cached (prediction, confidence), or None.
+        """
+        value = self.entries.get(key)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return value
+
+    def put(self, key, value):
+        """Cache a prediction.
+
+        :param key: a ROI hash (see key).
+        :param value: a (prediction, confidence) 2-tuple.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+
+def frameSource(source):
+    """Iterate over the frames of a video, camera or directory of images.
+
+    :param source: a camera index, a path to a video file or a directory of images (read in name order, see
+    bulk.imageExtensions), or any other iterable of frames, which is returned as is.
+
+    :return: an iterator of 3-channel color images (ndarray).
+    """
+    if type(source) is str and os.path.isdir(source):
+        paths = sorted(p for p in glob.glob(os.path.join(source, '*.*')) if p.lower().endswith(bulk.imageExtensions))
+        # Grayscale and 4-channel images are read as 3-channel color, files which are not images are skipped:
+        return (frame for frame in (cv.imread(path, testing.imreadFlags) for path in paths) if frame is not None)
+
+    if type(source) in (int, str):
+        return _capture(source)
+
+    return iter(source)
+
+
+def stream(model, frames, cache=None, context=None, scale=None, diffScale=0.125, threshold=12):
+    """Detect and classify digits in a stream of frames, redoing as little work as possible between frames.
+
+    Consecutive frames of a document camera are almost identical, so every frame is first compared against the
+    last processed one, on downscaled grayscale copies:
+    . if no pixel changed, the frame is skipped and the last digits are returned again.
+    . otherwise digits are detected (see testing.detectDigits), and those whose box and region didn't change are reused.
+    The remaining ROIs are normalized and looked up in a prediction cache by their hash. Only cache misses
+    are evaluated by the model, in a single batch.
+
+    :param model: model to predict with.
+
+    :param frames: an iterable of 3-channel color images (see frameSource).
+
+    :param cache: an optional PredictionCache, i.e.: to share it between streams. Defaults to a new one.
+
+    :param context: an optional testing.ContourContext.
+
+    :param scale: see testing.detectDigits.
+
+    :param diffScale: the factor to downscale frames by before comparing them. Downscaling averages out sensor noise.
+
+    :param threshold: the largest difference between two downscaled pixels (out of 255) which counts as unchanged.
+
+    :return: a generator of FrameResult, one per frame.
+    """
+    cache = PredictionCache() if cache is None else cache
+    context = context or testing.ContourContext()
+    reference, previous = None, {}
+
+    for i, frame in enumerate(frames):
+        t = time.perf_counter()
+        small = cv.resize(
+            cv.cvtColor(frame, cv.COLOR_BGR2GRAY), None, fx=diffScale, fy=diffScale, interpolation=cv.INTER_AREA
+        )
+        diff = cv.absdiff(small, reference) if reference is not None and reference.shape == small.shape else None
+
+        if diff is not None and diff.max() < threshold:
+            yield FrameResult(
+                i, list(previous.values()), True, len(previous), time.perf_counter() - t, cache.hitRate
+            )
+            continue
+
+        boxes, binary = testing.detectDigits(frame, context, scale)
+        digits, changed = [None] * len(boxes), []
+
+        for j, box in enumerate(boxes):
+            if diff is not None and box in previous and _unchanged(diff, box, diffScale, threshold):
+                digits[j] = previous[box]
+            else:
+                changed.append(j)
+
+        if changed:
+            batch = testing.normalizeROIs(binary, [boxes[j] for j in changed])
+            keys = [cache.key(roi) for roi in batch]
+            values = [cache.get(key) for key in keys]
+            misses = [k for k, value in enumerate(values) if value is None]
+
+            if misses:
+                modelOut = model(nn.NetVar(batch[misses]))
+
+                for k, p, c in zip(misses, np.argmax(modelOut, axis=1), np.max(modelOut, axis=1)):
+                    values[k] = int(p), float(c)
+                    cache.put(keys[k], values[k])
+
+            for j, (p, c) in zip(changed, values):
+                digits[j] = testing.Digit(p, c, boxes[j])
+
+        reference, previous = small, dict(zip(boxes, digits))
+        yield FrameResult(i, digits, False, len(boxes) - len(changed), time.perf_counter() - t, cache.hitRate)
+
+
+def benchmark(model, frames, **kwargs):
+    """Compare streaming against detecting and classifying every frame from scratch (see testing.predictDigits).
+
+    :param model: model to predict with.
+
+    :param frames: a list of frames (see stream).
+
+    :param kwargs: see stream.
+
+    :return: a dictionary with the time per frame of each mode, the speedup, how many frames were skipped,
+    the cache hit rate and how many frames had different predictions (digits or boxes). Frames which only differ
+    by noise from the last processed frame are skipped, so their predictions can differ.
+    """
+    context = testing.ContourContext()
+    t = time.perf_counter()
+    expected = [testing.predictDigits(model, frame, context, kwargs.get('scale'))[0] for frame in frames]
+    full = (time.perf_counter() - t) / len(frames)
+
+    results = list(stream(model, frames, **kwargs))
+    streamed = sum(r.latency for r in results) / len(frames)
+    # Confidences may differ in the last bits, since the model evaluates differently sized batches:
+    different = sum(
+        sorted((d.box, d.prediction) for d in r.digits) != sorted((d.box, d.prediction) for d in e)
+        for r, e in zip(results, expected)
+    )
+
+    report = {
+        'full': full, 'stream': streamed, 'speedup': full / streamed, 'skipped': sum(r.skipped for r in results),
+        'hitRate': results[-1].hitRate, 'different': different
+    }
+    print('full: {:,.4f} sec./frame | stream: {:,.4f} sec./frame | speedup: {:,.2f}x | skipped: {} | '
+          'hit rate: {:,.2%} | frames with different predictions: {}'.format(*report.values()))
+    return report
+
+
+def _capture(source):
+    capture = cv.VideoCapture(source)
+
+    try:
+        while True:
+            ok, frame = capture.read()
+
+            if not ok:
+                break
+
+            yield frame
+    finally:
+        capture.release()
+
+
+def _unchanged(diff, box, diffScale, threshold):
+    # Whether no downscaled pixel under a box changed:
+    x, y, w, h = box
+    region = diff[int(y * diffScale):int((y + h) * diffScale) + 1, int(x * diffScale):int((x + w) * diffScale) + 1]
+    return region.max() < threshold
@@ -23,133 +23,286 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import namedtuple
+import time
 import nnkit as nn
 import numpy as np
 import cv2 as cv
 
+import evaluation
+
 outputIntermediates = False
 
+"""Flags to decode images with (cv.imread, cv.imdecode): 3-channel color at half resolution. These are the pixels
+cv.CV_8UC4 (which OpenCV reads as a reduced size flag) gives for color images, but grayscale and 4-channel images
+are converted to 3 channels too."""
+imreadFlags = cv.IMREAD_REDUCED_COLOR_2
+
 
-def testMNIST(model, testSet):
+def testMNIST(model, testSet, chunkSize=1000):
     """Test a model against the MNIST test set.
     
     :param model: a model to test on. 
     
     :param testSet: a 2-tuple where the first element contains the MNIST test examples and 
-    the second element contains the target labels for each example in one-hot form.
+    the second element contains the target labels for each example, as class indices or in one-hot form.
     The test set needs to be disjoint from BOTH the training and validation sets.
+
+    :param chunkSize: how many examples to evaluate per forward pass (see evaluation.evaluate).
      
     :return: a test accuracy score, as a percentage.
     """
-    x = nn.NetVar(testSet[0])
-    prediction = model(x)
-    prediction = np.argmax(prediction, axis=1)
-    target = np.argmax(testSet[1], axis=1)
-    accuracy = np.mean(prediction == target)
-    return accuracy
+    return evaluation.evaluate(model, testSet, chunkSize).accuracy
 
 
-def testCustom(model, imgPaths):
+def testCustom(model, imgPaths, scale=None):
     """Test a model against custom images.
 
     :param model: model to test on.
     :param images: a list of paths to images.
+    :param scale: see detectDigits.
     """
+    context = ContourContext()
 
     for path in imgPaths:
-        # Extract all detected contours from image:
+        # Detect and classify all digits in the image:
         img = cv.imread(path, cv.CV_8UC4)
 
         if outputIntermediates:
             cv.imwrite('7-01-in.png', img)
 
-        contours, binary, _ = extractContours(img)
+        digits, binary = predictDigits(model, img, context, scale)
+
+        # Display annotated image:
+        binaryCopy = annotate(binary, digits)
+
+        if outputIntermediates:
+            cv.imwrite('7-13-label.png', binaryCopy)
+
+        cv.namedWindow(path, cv.WINDOW_NORMAL)
+        cv.imshow(path, binaryCopy)
+        cv.waitKey()
+        cv.destroyAllWindows()
 
-        # Create a copy if the image for annotation / display:
-        binaryCopy = cv.cvtColor(binary, cv.COLOR_GRAY2BGR)
 
-        for i, contour in enumerate(contours):
-            # Extract ROI and normalize it:
-            x, y, w, h = cv.boundingRect(contour)
-            roi = binary[y:y + h, x:x + w]
+"""A digit detected in an image:
+. prediction: the predicted digit.
+. confidence: the model's output for the predicted digit.
+. box: (x, y, w, h) bounding box of the digit in the image.
+"""
+Digit = namedtuple('Digit', ['prediction', 'confidence', 'box'])
 
-            if outputIntermediates:
-                cv.imwrite('7-07-{}-roi.png'.format(i), roi)
 
-            roi = normalize(roi, i)
+def predictDigits(model, colorIn, context=None, scale=None):
+    """Detect and classify all digits in an image.
 
-            # Make prediction:
-            modelIn = roi.flatten() / 255
-            modelOut = model(modelIn)
+    All ROIs in the image are normalized and stacked into a single batch, so the model
+    is evaluated once per image instead of once per digit.
 
-            prediction = np.argmax(modelOut)
+    :param model: model to predict with.
 
-            # Annotate image copy:
-            R = np.random.randint(0, 255)
-            G = np.random.randint(0, 255)
-            B = np.random.randint(0, 255)
-            color = (B, G, R, 255)
+    :param colorIn: a 3-channel color image (ndarray).
 
-            cv.rectangle(binaryCopy, (x, y), (x + w, y + h), color, 4)
-            cv.putText(binaryCopy, str(prediction),
-                       (x + w // 2 - 10, y + h // 2 + 10), 2, 1, color, 1)
-            cv.putText(binaryCopy, '{:,.2f}'.format(np.max(modelOut)),
-                       (x + w // 2 - 10, y + h // 2 + 40), 2, 1, color, 1)
+    :param context: an optional ContourContext (see extractContours).
+
+    :param scale: see detectDigits.
+
+    :return: (digits, binary), where:
+    . digits: a list of Digit, one per ROI found in the image.
+    . binary: the binary image the digits were extracted from.
+    """
+    boxes, binary = detectDigits(colorIn, context, scale)
+
+    if not boxes:
+        return [], binary
+
+    modelOut = model(nn.NetVar(normalizeROIs(binary, boxes)))
+    predictions = np.argmax(modelOut, axis=1)
+    confidences = np.max(modelOut, axis=1)
+
+    return [
+        Digit(int(p), float(c), box) for p, c, box in zip(predictions, confidences, boxes)
+    ], binary
+
+
+def detectDigits(colorIn, context=None, scale=None):
+    """Find the bounding boxes of potential digits in an image.
+
+    :param colorIn: a 3-channel color image (ndarray).
+
+    :param context: an optional ContourContext (see extractContours).
+
+    :param scale: optional scale factor (i.e.: 0.25) to find contours coarse to fine at (see extractContoursPyramid,
+    which is only faster on some images). By default contours are found at full resolution.
+
+    :return: (boxes, binary), where:
+    . boxes: a list of (x, y, w, h) ROIs, without tiny or absurd ones (see filterBoxes).
+    . binary: the binary image the ROIs were found in.
+    """
+    if scale:
+        contours, binary, _ = extractContoursPyramid(colorIn, scale, context)
+    else:
+        contours, binary, _ = extractContours(colorIn, context)
+
+    return filterBoxes([cv.boundingRect(contour) for contour in contours], binary.shape), binary
+
+
+def filterBoxes(boxes, shape, minSize=0.013, maxAspect=2.5, maxFraction=0.9, maxInside=3):
+    """Drop ROIs which can't be digits.
+
+    :param boxes: a list of (x, y, w, h) ROIs.
+
+    :param shape: the (rows, cols) shape of the image the ROIs are in.
+
+    :param minSize: the smallest height of a digit, as a fraction of the image's shorter side (so it holds at any
+    resolution; the default is 16 pixels on the bundled photos). Smaller ROIs are specks of noise.
+
+    :param maxAspect: the largest width to height ratio of a digit. Wider ROIs are lines, edges of paper, etc.
+
+    :param maxFraction: the largest fraction of the image's area a digit can take.
+
+    :param maxInside: ROIs containing this many other ROIs (or more) are frames around digits (i.e.: a sheet of paper).
+
+    :return: the ROIs which pass.
+    """
+    if not boxes:
+        return []
+
+    b = np.array(boxes)
+    x, y, w, h = b.T
+    keep = (h >= minSize * min(shape[:2])) & (w <= maxAspect * h) & (w * h <= maxFraction * shape[0] * shape[1])
+
+    # Count the ROIs each ROI contains, among those which passed:
+    x1, y1 = x + w, y + h
+    inside = (
+        (x[:, None] <= x[None, :]) & (y[:, None] <= y[None, :]) & (x1[:, None] >= x1[None, :]) &
+        (y1[:, None] >= y1[None, :]) & keep[None, :]
+    )
+    np.fill_diagonal(inside, False)
+    keep &= np.sum(inside, axis=1) < maxInside
+
+    return [boxes[i] for i in np.flatnonzero(keep)]
+
+
+def normalizeROIs(binaryIn, boxes):
+    """Normalize ROIs of a binary image and stack them into a model input.
+
+    :param binaryIn: a binary image.
+    :param boxes: a list of (x, y, w, h) ROIs in binaryIn.
+
+    :return: a (len(boxes), 784) array of normalized ROIs, scaled to [0, 1].
+    """
+    batch = np.empty((len(boxes), 28 * 28), nn.dtype)
+
+    for i, (x, y, w, h) in enumerate(boxes):
+        roi = binaryIn[y:y + h, x:x + w]
 
-        # Display annotated image:
         if outputIntermediates:
-            cv.imwrite('7-13-label.png', binaryCopy)
+            cv.imwrite('7-07-{}-roi.png'.format(i), roi)
+
+        batch[i] = normalize(roi, i).ravel()
+
+    batch /= 255
+    return batch
+
+
+def annotate(binaryIn, digits):
+    """Draw the bounding box, prediction and confidence of digits on a color copy of a binary image.
+
+    :param binaryIn: a binary image.
+    :param digits: a list of Digit found in binaryIn.
+
+    :return: the annotated copy.
+    """
+    annotated = cv.cvtColor(binaryIn, cv.COLOR_GRAY2BGR)
+
+    for prediction, confidence, (x, y, w, h) in digits:
+        R = np.random.randint(0, 255)
+        G = np.random.randint(0, 255)
+        B = np.random.randint(0, 255)
+        color = (B, G, R, 255)
+
+        cv.rectangle(annotated, (x, y), (x + w, y + h), color, 4)
+        cv.putText(annotated, str(prediction),
+                   (x + w // 2 - 10, y + h // 2 + 10), 2, 1, color, 1)
+        cv.putText(annotated, '{:,.2f}'.format(confidence),
+                   (x + w // 2 - 10, y + h // 2 + 40), 2, 1, color, 1)
+
+    return annotated
+
+
+class ContourContext:
+    """Scratch buffers for extractContours, reused across calls.
+
+    Passing the same context to repeated calls avoids reallocating intermediate images as long
+    as the input size doesn't change. Note that the binary and edge images returned by extractContours
+    are then owned by the context, and are overwritten by the next call using it.
+    """
+    def __init__(self):
+        self.shape = None
+        self.gray, self.blur, self.binary, self.edges = None, None, None, None
+
+    def buffers(self, shape):
+        """Get buffers for an input of a given (rows, cols) shape, reallocating only if the shape changed.
+
+        :return: (gray, blur, binary, edges) uint8 images.
+        """
+        if shape != self.shape:
+            self.shape = shape
+            self.gray, self.blur, self.binary, self.edges = [np.empty(shape, np.uint8) for _ in range(4)]
+
+        return self.gray, self.blur, self.binary, self.edges
 
-        cv.namedWindow(path, cv.WINDOW_NORMAL)
-        cv.imshow(path, binaryCopy)
-        cv.waitKey()
-        cv.destroyAllWindows()
 
+# Contrast stretch, evaluated once per possible uint8 value:
+# (same arithmetic as stretching each pixel in float64 and truncating back to uint8)
+contrastLUT = np.uint8([max(min(v * 1.9 - 255., 255.), 0.) for v in range(256)])
 
-def extractContours(colorIn):
+# Contrast stretch followed by inverted threshold, so digits are white:
+binaryLUT = np.uint8([255 if 255 - c > 180 else 0 for c in contrastLUT])
+
+
+def extractContours(colorIn, context=None, blurSize=11):
     """Extract contours of potential ROIs from an image.
 
     :param colorIn: a 3-channel color image (ndarray) to find contours in.
-    
+
+    :param context: an optional ContourContext whose buffers are used for intermediate images.
+
+    :param blurSize: the (odd) size of the Gaussian blur kernel.
+
     :return: (contours, binaryOut, edges), where:
     . contours: a list of 2d point sets making up the contour of each ROI.
     . binaryOut: a binary inverted (black and white) thresholded copy of colorIn.
     . a binary edge version of binaryOut.
     """
-    contours = []
+    gray, blur, binaryOut, edges = (context or ContourContext()).buffers(colorIn.shape[:2])
 
-    binaryOut = cv.cvtColor(colorIn, cv.COLOR_BGR2GRAY)
+    cv.cvtColor(colorIn, cv.COLOR_BGR2GRAY, dst=gray)
 
-    if outputIntermediates:
-        cv.imwrite('7-02-gray.png', binaryOut)
+    return _extractContours(gray, blur, binaryOut, edges, blurSize)
 
-    # Filter out some high freqs:
-    binaryOut = cv.GaussianBlur(binaryOut, (11, 11), 0)
 
+def _extractContours(gray, blur, binaryOut, edges, blurSize=11):
+    # extractContours from a grayscale image, into the given buffers:
     if outputIntermediates:
-        cv.imwrite('7-03-blur.png', binaryOut)
+        cv.imwrite('7-02-gray.png', gray)
 
-    # Increase contrast:
-    binaryOut = np.double(binaryOut)
-
-    for i in range(binaryOut.shape[0]):
-        for j in range(binaryOut.shape[1]):
-            binaryOut[i][j] = min(binaryOut[i][j] * 1.9 - 255., 255.)
-            binaryOut[i][j] = max(binaryOut[i][j], 0.)
-
-    binaryOut = np.uint8(binaryOut)
+    # Filter out some high freqs:
+    cv.GaussianBlur(gray, (blurSize, blurSize), 0, dst=blur)
 
     if outputIntermediates:
-        cv.imwrite('7-04-contrast.png', binaryOut)
+        cv.imwrite('7-03-blur.png', blur)
+        cv.imwrite('7-04-contrast.png', cv.LUT(blur, contrastLUT))
 
-    # Make binary inverted (so digits are white):
-    _, binaryOut = cv.threshold(255 - binaryOut, 180, 255, cv.THRESH_BINARY)
+    # Increase contrast and make binary inverted (so digits are white), both through one lookup:
+    cv.LUT(blur, binaryLUT, dst=binaryOut)
 
     if outputIntermediates:
         cv.imwrite('7-05-binary.png', binaryOut)
 
     # Extract contours from binary edges:
-    edges = cv.Canny(binaryOut, 50, 255)
+    cv.Canny(binaryOut, 50, 255, edges=edges)
 
     if outputIntermediates:
         cv.imwrite('7-06-canny.png', edges)
@@ -159,6 +312,201 @@ def extractContours(colorIn):
     return contours, binaryOut, edges
 
 
+def extractContoursPyramid(colorIn, scale=0.25, context=None, margin=None, maxCoverage=0.25):
+    """Extract contours of potential ROIs from an image, coarse to fine.
+
+    Candidate regions are found on a downscaled copy of the image, then only those regions are binarized
+    and searched for contours at full resolution. Contours of digits are the same as those of extractContours:
+    each region is blurred with enough surrounding pixels for the blur to match the full resolution one.
+    This is not a speed-up on the bundled photos: they fall back to full resolution, and the coarse pass
+    makes them 10-40% slower (see benchmarkPyramid). It can only pay off when digits cover little of a large
+    image. Measure with benchmarkPyramid before using it.
+
+    :param colorIn: a 3-channel color image (ndarray) to find contours in.
+
+    :param scale: the factor to downscale the image by to find candidate regions.
+
+    :param context: an optional ContourContext whose buffers are used for intermediate images.
+
+    :param margin: how many full resolution pixels to grow candidate regions by on each side, to make up for
+    coarse contours being off by a few pixels. Defaults to 4 coarse pixels plus 8.
+
+    :param maxCoverage: the fraction of the image candidate regions may cover before falling back to
+    extractContours. Decided from the coarse pass, before refining. Refining costs about 1.4 times a full
+    resolution pass per pixel, and regions still grow while refined (from 0.3 to 0.9 of data/digits.JPG),
+    hence the low default.
+
+    :return: (contours, binaryOut, edges), as in extractContours. binaryOut and edges are black outside
+    of candidate regions.
+    """
+    rows, cols = colorIn.shape[:2]
+
+    # Too small to be worth downscaling:
+    if min(rows, cols) * scale < 64:
+        return extractContours(colorIn, context)
+
+    gray, blur, binaryOut, edges = (context or ContourContext()).buffers((rows, cols))
+    margin = int(4 / scale) + 8 if margin is None else margin
+    radius = 11 // 2
+
+    # Find candidate regions on the downscaled image, without tiny or absurd ones:
+    cv.cvtColor(colorIn, cv.COLOR_BGR2GRAY, dst=gray)
+    small = cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    size = max(3, int(11 * scale) | 1)
+    coarseEdges = cv.Canny(cv.LUT(cv.GaussianBlur(small, (size, size), 0), binaryLUT), 50, 255)
+    _, coarse, _ = cv.findContours(coarseEdges, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    boxes = [cv.boundingRect(c) for c in coarse]
+
+    def fullResolution(boxes):
+        return [
+            (max(0, int(x / scale) - margin), max(0, int(y / scale) - margin),
+             min(cols, int((x + w) / scale) + margin), min(rows, int((y + h) / scale) + margin))
+            for x, y, w, h in boxes
+        ]
+
+    regions = _mergeRegions(fullResolution(
+        # Half the full resolution minimum, coarse contours of thin digits are shorter:
+        filterBoxes(boxes, small.shape, minSize=0.013 / 2, maxAspect=np.inf)
+    ))
+
+    # Regions grow over whatever they cut through at full resolution (see below). Grow them over the coarse
+    # contours they overlap (lines, edges of paper, etc.) now, to decide from the coarse pass alone whether
+    # refining them is worth it:
+    others = fullResolution(boxes)
+
+    while True:
+        grown = _mergeRegions(regions + [r for r in others if any(_overlap(r, region) for region in regions)])
+
+        if grown == regions:
+            break
+
+        regions = grown
+
+    if sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions) > maxCoverage * rows * cols:
+        # The grayscale image is done already:
+        return _extractContours(gray, blur, binaryOut, edges)
+
+    # Refine each region at full resolution. Regions cutting through a contour grow on the cut sides
+    # and are refined again, until every contour is whole:
+    refined = {}
+
+    while True:
+        grown = []
+
+        for region in regions:
+            if region not in refined:
+                refined[region] = _refineRegion(gray, region, radius)
+
+            x0, y0, x1, y1 = region
+
+            for bx, by, bw, bh in refined[region][3]:
+                # Grow cut sides by the size of the region, so long objects take few rounds:
+                dx, dy = max(margin, x1 - x0), max(margin, y1 - y0)
+                grow = bx <= x0 + 1 and x0, by <= y0 + 1 and y0, bx + bw >= x1 - 1 and x1 < cols, \
+                    by + bh >= y1 - 1 and y1 < rows
+
+                if any(grow):
+                    grown.append((
+                        max(0, x0 - dx * bool(grow[0])), max(0, y0 - dy * bool(grow[1])),
+                        min(cols, x1 + dx * bool(grow[2])), min(rows, y1 + dy * bool(grow[3]))
+                    ))
+
+        if not grown:
+            break
+
+        regions = _mergeRegions(regions + grown)
+
+    binaryOut.fill(0)
+    edges.fill(0)
+    contours = []
+
+    for x0, y0, x1, y1 in regions:
+        binary, regionEdges, regionContours, _ = refined[(x0, y0, x1, y1)]
+        binaryOut[y0:y1, x0:x1] = binary
+        edges[y0:y1, x0:x1] = regionEdges
+        contours.extend(regionContours)
+
+    return contours, binaryOut, edges
+
+
+def benchmarkPyramid(model, paths, scale=0.25, repeat=5):
+    """Compare full resolution and coarse to fine digit detection.
+
+    :param model: model to predict with.
+
+    :param paths: paths to images.
+
+    :param scale: see extractContoursPyramid.
+
+    :param repeat: how many times to detect digits in each image. The best time is kept.
+
+    :return: a dictionary per image path with the best time of each mode, the speedup and whether
+    predictions (digit, confidence and box) are the same.
+    """
+    results = {}
+    context = ContourContext()
+
+    for path in paths:
+        img = cv.imread(path, cv.CV_8UC4)
+        times, digits = {}, {}
+
+        for name, s in [('full', None), ('pyramid', scale)]:
+            best = np.inf
+
+            for _ in range(repeat):
+                t = time.perf_counter()
+                boxes, binary = detectDigits(img, context, s)
+                best = min(best, time.perf_counter() - t)
+
+            times[name] = best
+            digits[name] = predictDigits(model, img, context, s)[0]
+
+        same = sorted(digits['full'], key=lambda d: d.box) == sorted(digits['pyramid'], key=lambda d: d.box)
+        results[path] = dict(times, speedup=times['full'] / times['pyramid'], same=same)
+        print('{}: full: {:,.4f} sec. | pyramid: {:,.4f} sec. | speedup: {:,.2f}x | digits: {} | same predictions: {}'.format(
+            path, times['full'], times['pyramid'], results[path]['speedup'], len(digits['full']), results[path]['same']
+        ))
+
+    return results
+
+
+def _mergeRegions(regions):
+    # Merge overlapping (x0, y0, x1, y1) regions until none overlap, so no pixel is searched twice:
+    merged = True
+
+    while merged:
+        merged, out = False, []
+
+        for r in regions:
+            for i, m in enumerate(out):
+                if _overlap(r, m):
+                    out[i] = min(r[0], m[0]), min(r[1], m[1]), max(r[2], m[2]), max(r[3], m[3])
+                    merged = True
+                    break
+            else:
+                out.append(r)
+
+        regions = out
+
+    return regions
+
+
+def _overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _refineRegion(gray, region, radius):
+    # Blur with the pixels around the region too, so the region matches a full resolution blur:
+    rows, cols = gray.shape
+    x0, y0, x1, y1 = region
+    ox0, oy0, ox1, oy1 = max(0, x0 - radius), max(0, y0 - radius), min(cols, x1 + radius), min(rows, y1 + radius)
+    blur = cv.GaussianBlur(gray[oy0:oy1, ox0:ox1], (2 * radius + 1, 2 * radius + 1), 0)
+    binary = cv.LUT(np.ascontiguousarray(blur[y0 - oy0:y1 - oy0, x0 - ox0:x1 - ox0]), binaryLUT)
+    edges = cv.Canny(binary, 50, 255)
+    _, contours, _ = cv.findContours(edges.copy(), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
+    return binary, edges, contours, [cv.boundingRect(c) for c in contours]
+
+
 def normalize(binaryIn, i):
     """Center an image inside a 20x20 px area and pads it by 4px on each side.
 
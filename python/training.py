@@ -23,24 +23,40 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from copy import deepcopy
-from itertools import product
+from itertools import chain, product, repeat
 from collections import deque
+from contextlib import nullcontext
+import multiprocessing as mp
+import pickle
+import glob
+import os
+import time
 import nnkit as nn
 import numpy as np
 
+import dataset
+import evaluation
+import statslog
 
-def trainMNIST(trainingSet, validationSet, epochs, layers, batchSizes, learnRates, keepBest):
+# State of a worker process in a parallel search (see _initWorker):
+_worker = {}
+
+
+def trainMNIST(trainingSet, validationSet, epochs, layers, batchSizes, learnRates, keepBest, workers=1, seed=None,
+               patience=None, prefetch=0, checkpointDir=None, checkpointEvery=1, resume=False, overwrite=False,
+               profiler=None, statsLog=None, validateEvery=1, validationSample=None, validationChunk=1000,
+               dataParallel=1, augmentation=None):
     """Train and validate models on MNIST with different hyper parameter combinations.
 
     This function trains and validates one model per hyper parameter combination. It then returns
     all training stats and the n (keepBest) models that scored the highest validation accuracy.
 
     :param trainingSet: a 2-tuple where the first element contains the MNIST training set examples and
-    the second element contains the target labels for each example in one-hot form.
+    the second element contains the target labels for each example, as class indices or in one-hot form.
+    Class indices are expanded to one-hot per minibatch.
 
     :param validationSet: a 2-tuple where the first element contains MNIST examples and
-    the second element contains the target labels for each example in one-hot form.
+    the second element contains the target labels for each example, as class indices or in one-hot form.
     This set must be disjoint from the training set.
 
     :param epochs: a list of epochs to train for.
@@ -58,24 +74,298 @@ def trainMNIST(trainingSet, validationSet, epochs, layers, batchSizes, learnRate
 
     :param keepBest: How many of the best models to return.
 
+    :param workers: how many processes to train models in. With more than 1 worker, combinations are spread
+    over a (forked) process pool. Workers inherit the training and validation sets from this process,
+    so the arrays are shared read-only instead of being pickled for every combination.
+
+    :param seed: an optional seed for numpy's random number generator. Each combination is seeded with
+    seed + its index in the search, so the stats of a model don't depend on the number of workers.
+    Without a seed, each combination is seeded from os.urandom.
+
+    :param patience: optional number of epochs without improving validation accuracy after which a model
+    stops training early (see Trainer.train).
+
+    :param prefetch: how many minibatches to gather ahead in a background thread while training
+    (see dataset.Minibatches). Time spent waiting for minibatches is printed every epoch.
+
+    :param checkpointDir: optional directory to write checkpoints to. The state of the model being trained
+    (weights, optimizer state, random state, epoch, stats and snapshots) is written every checkpointEvery epochs,
+    and the results of each combination (stats and snapshots) when it completes.
+
+    :param checkpointEvery: how many epochs between checkpoints of a model.
+
+    :param resume: whether to resume from the checkpoints in checkpointDir. Completed combinations are loaded
+    instead of trained, and interrupted ones continue from their last checkpoint. Resuming a seeded search
+    yields the same results as an uninterrupted one. Checkpoints must belong to the same search: a checkpoint
+    whose model doesn't match the combination at its index raises a ValueError.
+
+    :param overwrite: whether to delete existing checkpoints in checkpointDir when not resuming. Without it (or resume),
+    existing checkpoints raise a FileExistsError instead of being lost.
+
+    :param profiler: an optional profiling.Profiler to time batch gathering, forward and backward passes, optimizer
+    steps, validation and snapshotting on every epoch. Records are stored in each model's stats under 'profile'.
+    With more than 1 worker, each worker uses its own copy of the profiler, hooks included.
+
+    :param statsLog: optional path to a stats log (see statslog) to append every epoch's stats (and profile) to
+    as training goes, so a session can be followed while it runs. The log is emptied first, unless resuming.
+
+    :param validateEvery: how many epochs between validations. The last epoch a model trains for is always validated.
+    Epochs which aren't validated have no stats, can't be snapshotted and don't count towards patience.
+
+    :param validationSample: optional number of validation examples to validate on, picked once per search as a
+    stratified subsample (see dataset.stratifiedSample). Defaults to the whole validation set.
+
+    :param validationChunk: how many validation examples to evaluate per forward pass. Validation memory
+    is bounded by this instead of the size of the validation set.
+
+    :param dataParallel: how many processes to compute the gradients of each minibatch over (see parallel.DataParallel).
+    Batch sizes are global: each process gets an equal shard of every minibatch. Can't be combined with workers.
+
+    :param augmentation: an optional augmentation.Augmentation to apply to training minibatches as they are gathered.
+    Use prefetch to augment in the background while the previous minibatch trains.
+
     :return: a 2-tuple where the first element is a dictionary of training stats for all models and the second element
     is a list of the highest n (keepBest) scoring models.
     """
-    # x = raw pixels, y = one-hot target for loss evaluation:
-    x, y = nn.NetVar(), nn.NetVar()
-    idx = list(range(len(trainingSet[0])))
-    combinations = product(layers, batchSizes, learnRates)
-    validationTarget = np.argmax(validationSet[1].data, axis=1)
+    combinations = list(product(layers, batchSizes, learnRates))
+    trainerArgs = dict(
+        epochs=epochs, keepBest=keepBest, seed=seed, prefetch=prefetch, profiler=profiler, statsLog=statsLog,
+        validateEvery=validateEvery, validationSample=validationSample, validationChunk=validationChunk,
+        dataParallel=dataParallel, augmentation=augmentation
+    )
+    trainArgs = dict(patience=patience, checkpointDir=checkpointDir, checkpointEvery=checkpointEvery)
     bestQueue = deque(maxlen=keepBest)
     allStats = {}
+    completed = {}
+
+    if checkpointDir:
+        os.makedirs(checkpointDir, exist_ok=True)
+
+        paths = glob.glob(os.path.join(checkpointDir, '*.ckpt'))
+
+        if paths and not resume and not overwrite:
+            raise FileExistsError('{} has checkpoints of a previous search. Pass resume to continue it or overwrite '
+                                  'to start over.'.format(checkpointDir))
+
+        for path in paths:
+            if resume:
+                if os.path.basename(path).startswith('combination-'):
+                    result = _load(path)
+                    i = result['index']
+
+                    if i >= len(combinations) or result['key'] != _key(epochs, combinations[i]):
+                        raise ValueError('{}: checkpoint of {} doesn\'t match combination {} of this search. '
+                                         'Pass overwrite to start over.'.format(path, result['key'], i))
+
+                    completed[i] = result['key'], result['stats'], _snapshots(result['best'])
+            else:
+                os.remove(path)
+
+    # A new search starts a new log, so records of a previous one don't pass for its own:
+    if statsLog and not resume:
+        statslog.StatsLog(statsLog).clear()
+
+    if workers > 1 and dataParallel > 1:
+        raise ValueError('workers and dataParallel can\'t be combined: pool workers can\'t fork replicas.')
+
+    if workers > 1:
+        # Models are trained independently, so each worker only snapshots its own improvements.
+        # Merging them in combination order yields the same queue as a serial run:
+        context = mp.get_context('fork')
+        initArgs = trainingSet, validationSet, combinations, trainerArgs, trainArgs
+
+        pending = [i for i in range(len(combinations)) if i not in completed]
+
+        with context.Pool(max(1, min(workers, len(pending))), _initWorker, initArgs) as pool:
+            results = pool.imap(_trainWorker, pending)
+
+            for i in range(len(combinations)):
+                key, stats, best = completed[i] if i in completed else next(results)
+                allStats[key] = stats
+                mergeBest(bestQueue, best)
+    else:
+        for i, combination in enumerate(combinations):
+            if i in completed:
+                key, stats, best = completed[i]
+                print('++ COMPLETED MODEL: {} ++'.format(key))
+            else:
+                threshold = bestQueue[-1][2] if len(bestQueue) else -np.inf
+                key, stats, best = trainCombination(
+                    i, combination, trainingSet, validationSet, trainerArgs, trainArgs, threshold
+                )
+
+            allStats[key] = stats
+            mergeBest(bestQueue, best)
+
+    return allStats, bestQueue
+
+
+def trainMNISTHalving(trainingSet, validationSet, epochs, layers, batchSizes, learnRates, keepBest,
+                      minEpochs=5, eta=3, seed=None, patience=None, prefetch=0, profiler=None, statsLog=None,
+                      validateEvery=1, validationSample=None, validationChunk=1000, dataParallel=1,
+                      augmentation=None):
+    """Search hyper parameter combinations on MNIST with successive halving.
+
+    All models are trained for a short budget of epochs, then ranked by their highest validation accuracy.
+    Only the top 1/eta models (but never fewer than keepBest) survive and the budget grows by a factor of eta,
+    until the survivors reach the total number of epochs. Pruning decisions are recorded in the stats of each
+    pruned model under 'pruned'.
+
+    :param trainingSet, validationSet, epochs, layers, batchSizes, learnRates, keepBest, seed, patience, prefetch,
+    profiler, statsLog, validateEvery, validationSample, validationChunk, dataParallel, augmentation: see trainMNIST.
+
+    :param minEpochs: the budget of epochs all models train for before the first pruning round.
+
+    :param eta: the reduction factor between rounds. i.e.: 3 keeps the top third of the models and triples
+    the budget.
+
+    :return: a 2-tuple where the first element is a dictionary of training stats for all models and the second element
+    is a list of the highest n (keepBest) scoring models.
+    """
+    trainers = [
+        Trainer(
+            i, combination, trainingSet, validationSet, epochs, keepBest, seed, prefetch, profiler, statsLog,
+            validateEvery, validationSample, validationChunk, dataParallel, augmentation
+        )
+        for i, combination in enumerate(product(layers, batchSizes, learnRates))
+    ]
+
+    alive, budget, rung = list(trainers), minEpochs, 0
+
+    while alive:
+        print('++ RUNG {}: {} models up to epoch {} ++'.format(rung, len(alive), min(budget, epochs)))
 
-    # Train one model per hyper parameter combination:
-    for layers, batchSize, learnRate in combinations:
-        key = str((epochs, layers, batchSize, learnRate[0]))
-        stats = {}
-        allStats[key] = stats
+        for trainer in alive:
+            print('++ MODEL: {} ++'.format(trainer.key))
+            trainer.train(until=budget, patience=patience)
 
-        print('++ NEW MODEL: {} ++'.format(key))
+        alive = [t for t in alive if not t.stopped]
+
+        if budget >= epochs:
+            break
+
+        # Keep the top 1/eta models by validation accuracy:
+        ranked = sorted(alive, key=lambda t: t.accuracy, reverse=True)
+        keep = max(min(keepBest, len(ranked)), int(np.ceil(len(ranked) / eta)))
+
+        for rank, trainer in enumerate(ranked[keep:], keep + 1):
+            print('\t pruned: {} | rank: {}/{} | val accuracy: {:,.2f}%'.format(
+                trainer.key, rank, len(ranked), trainer.accuracy
+            ))
+
+            trainer.prune(reason='halving', rung=rung, rank=rank, of=len(ranked))
+
+        alive = ranked[:keep]
+        budget *= eta
+        rung += 1
+
+    # Merge in combination order, like a serial search would:
+    bestQueue = deque(maxlen=keepBest)
+    allStats = {}
+
+    for trainer in trainers:
+        allStats[trainer.key] = trainer.stats
+        mergeBest(bestQueue, trainer.best)
+
+    return allStats, bestQueue
+
+
+def trainCombination(index, combination, trainingSet, validationSet, trainerArgs, trainArgs, threshold=-np.inf):
+    """Train a single model of a search, resuming it from a checkpoint if there is one.
+
+    :param index, combination: see Trainer.
+
+    :param trainingSet, validationSet: see trainMNIST.
+
+    :param trainerArgs: keyword arguments for Trainer.
+
+    :param trainArgs: keyword arguments for Trainer.train. If they include a checkpointDir, the result
+    is written to it once the model completes.
+
+    :param threshold: see Trainer.train.
+
+    :return: (key, stats, best) of the trained model (see Trainer).
+    """
+    trainer = Trainer(index, combination, trainingSet, validationSet, **trainerArgs)
+    checkpointDir = trainArgs.get('checkpointDir')
+    progress = checkpointDir and os.path.join(checkpointDir, 'progress-{}.ckpt'.format(index))
+
+    if progress and os.path.exists(progress):
+        trainer.restore(_load(progress))
+        print('\t resumed from epoch {}'.format(trainer.epoch))
+
+    trainer.train(threshold=threshold, **trainArgs)
+
+    if checkpointDir:
+        _dump(os.path.join(checkpointDir, 'combination-{}.ckpt'.format(index)), {
+            'index': index, 'key': trainer.key, 'stats': trainer.stats,
+            'best': [(key, e, accuracy, _weights(model.topology)) for key, e, accuracy, model in trainer.best]
+        })
+
+        if os.path.exists(progress):
+            os.remove(progress)
+
+    return trainer.key, trainer.stats, list(trainer.best)
+
+
+class Trainer:
+    """Train and validate a single model of a hyper parameter search.
+
+    Training can be split over several calls to train, which is what lets a scheduler pause a model
+    and resume it later. Each trainer keeps its own random state, so the result of a model doesn't
+    depend on how its epochs are interleaved with those of other models.
+
+    Attributes:
+    . key: the model's key in the stats dictionary.
+    . stats: a dictionary of (trainLoss, valLoss, valAccuracy) per epoch.
+    . best: up to keepBest (key, epoch, valAccuracy, model) snapshots, in increasing order of accuracy.
+    . epoch: the last epoch trained.
+    . stopped: whether training ended before the last epoch (numerical instability or early stop).
+    """
+    def __init__(self, index, combination, trainingSet, validationSet, epochs, keepBest, seed=None, prefetch=0,
+                 profiler=None, statsLog=None, validateEvery=1, validationSample=None, validationChunk=1000,
+                 dataParallel=1, augmentation=None, verbose=True):
+        """Create the model for a hyper parameter combination.
+
+        :param index: the index of the combination in the search.
+
+        :param combination: a (layers, batchSize, learnRate) 3-tuple (see trainMNIST).
+
+        :param trainingSet, validationSet, epochs, keepBest, seed, prefetch, profiler, statsLog, validateEvery,
+        validationSample, validationChunk, dataParallel, augmentation: see trainMNIST.
+
+        :param verbose: whether to announce the new model.
+        """
+        layers, self.batchSize, self.learnRate = combination
+
+        # Unseeded models draw a fresh seed, or forked workers would all inherit (and repeat) the parent's random state:
+        np.random.seed(seed + index if seed is not None else int.from_bytes(os.urandom(4), 'little'))
+
+        self.index = index
+        self.validationSet = validationSet
+        self.profiler = profiler
+        self.statsLog = statsLog and statslog.StatsLog(statsLog)
+        self.validateEvery, self.validationChunk = validateEvery, validationChunk
+        self.dataParallel = dataParallel
+
+        # The same subsample for every model of a search, so their accuracies compare:
+        self.validationIndices = validationSample and dataset.stratifiedSample(
+            validationSet[1], validationSample, seed or 0
+        )
+        self.epochs = epochs
+        self.key = _key(epochs, combination)
+        self.best = deque(maxlen=keepBest)
+        self.stats = {}
+        self.epoch = 0
+        self.stopped = False
+        self.sinceBest = 0
+
+        # x = raw pixels, y = one-hot target for loss evaluation:
+        self.x, self.y = nn.NetVar(), nn.NetVar()
+        self.minibatches = dataset.Minibatches(trainingSet, self.batchSize, prefetch, transform=augmentation)
+
+        if verbose:
+            print('++ NEW MODEL: {} ++'.format(self.key))
 
         # Define model topology according to layers hyper param:
         topology = []
@@ -93,49 +383,342 @@ def trainMNIST(trainingSet, validationSet, epochs, layers, batchSizes, learnRate
             (nn.Softmax,)
         ])
 
-        net = nn.FFN(*topology)
+        self.net = nn.FFN(*topology)
 
         # Create optimizer and loss node:
-        optimizer = nn.GD(net.vars)
-        net.topology.append((nn.CELoss, y))
+        self.optimizer = nn.GD(self.net.vars)
+        self.net.topology.append((nn.CELoss, self.y))
+        self.rngState = np.random.get_state()
+        self._training = False
+
+    @property
+    def accuracy(self):
+        """The highest validation accuracy of the model so far."""
+        return max([s[2] for s in self.stats.values() if type(s) is tuple], default=-np.inf)
+
+    def train(self, until=None, threshold=-np.inf, patience=None, checkpointDir=None, checkpointEvery=1):
+        """Train the model up to an epoch.
+
+        :param until: the epoch to train up to (inclusive). Defaults to the total number of epochs.
+
+        :param threshold: the validation accuracy a model has to beat before it is snapshotted.
+
+        :param patience: optional number of epochs without improving validation accuracy after which
+        training stops early. The stop is recorded in the stats under 'pruned'.
+
+        :param checkpointDir: optional directory to write the trainer's state to (see state), every checkpointEvery
+        epochs, as 'progress-<index>.ckpt'.
+
+        :param checkpointEvery: how many epochs between checkpoints.
+
+        :return: this trainer.
+        """
+        net, x, y = self.net, self.x, self.y
+        until = min(until or self.epochs, self.epochs)
+        np.random.set_state(self.rngState)
+        self._training = True
+        replicas = nullcontext()
+
+        if self.dataParallel > 1:
+            # Here, since parallel imports training:
+            import parallel
+            replicas = parallel.DataParallel(net, self.optimizer.params, self.dataParallel, self.batchSize)
+
+        with replicas:
+            self._train(until, threshold, patience, checkpointDir, checkpointEvery, replicas)
+
+        # Don't hold on to the last batch and activations between calls:
+        x.data, y.data = None, None
+        net.layers.clear()
+        self.rngState = np.random.get_state()
+        self._training = False
+        return self
+
+    def _train(self, until, threshold, patience, checkpointDir, checkpointEvery, replicas):
+        net, optimizer, x, y = self.net, self.optimizer, self.x, self.y
+        epochs, learnRate, profiler = self.epochs, self.learnRate, self.profiler
+        phase = profiler.phase if profiler else lambda name: nullcontext()
+
+        while self.epoch < until and not self.stopped:
+            e = self.epoch = self.epoch + 1
 
-        for e in range(1, epochs+1):
             # Train on random minibatches:
-            np.random.shuffle(idx)
+            waited = self.minibatches.waited
+
+            for batch in self.minibatches:
+                if self.dataParallel > 1:
+                    # Replicas run forward and backward passes together. Backward is the all-reduce of their gradients:
+                    with phase('forward'):
+                        trainingLoss = replicas.forwardBackward(*batch)
 
-            for i in range(0, len(idx), batchSize):
-                x.data, y.data = trainingSet[0][idx[i:i + batchSize]], trainingSet[1][idx[i:i + batchSize]]
-                trainingLoss = net(x)
-                net.back()
-                optimizer.learnRate = learnRate[1](epochs, e - 1)
-                optimizer.step()
+                    with phase('backward'):
+                        replicas.allReduce()
+                else:
+                    x.data, y.data = batch
+
+                    with phase('forward'):
+                        trainingLoss = net(x)
+
+                    with phase('backward'):
+                        net.back()
+
+                with phase('step'):
+                    optimizer.learnRate = learnRate[1](epochs, e - 1)
+                    optimizer.step()
 
             # Validate:
-            x.data, y.data = validationSet[0], validationSet[1]
-            validationLoss = net(x)
+            validated, newBest = not e % self.validateEvery or e >= until, False
+
+            if validated:
+                with phase('validation'):
+                    validation = self.validate()
+                    validationLoss, validationAccuracy = validation.loss, validation.accuracy * 100
+
+                if np.isnan(validationLoss):
+                    print('numerical instability -- abort --.')
+                    self.stopped = True
+
+                    if profiler:
+                        profiler.times.clear()
+
+                    break
+
+                self.sinceBest = 0 if validationAccuracy > self.accuracy else self.sinceBest + 1
+                self.stats[e] = (trainingLoss.item(), validationLoss, validationAccuracy)
+
+                # Keep best model so far:
+                if validationAccuracy > (self.best[-1][2] if len(self.best) else threshold):
+                    with phase('snapshot'):
+                        self.best.append((self.key, e, validationAccuracy, self.snapshot()))
+
+                    newBest = True
+
+            if profiler:
+                profiler.add('batch', self.minibatches.waited - waited)
+                profile = self.stats.setdefault('profile', {})
+                profile[e] = profiler.epoch(self.key, e, len(self.minibatches.idx))
 
-            if np.isnan(validationLoss):
-                print('numerical instability -- abort --.')
-                break
+            if self.statsLog and (validated or profiler):
+                self.statsLog.append(
+                    self.key, e,
+                    **({'stats': self.stats[e]} if validated else {}),
+                    **({'profile': self.stats['profile'][e]} if profiler else {})
+                )
+
+            if validated:
+                print('\t e:{} | train loss: {:,.3f} | val loss: {:,.3f} | val accuracy: {:,.2f}% | '
+                      'learn rate: {:,.2f} | data wait: {:,.2f}s {}'.format(
+                    e, *self.stats[e], optimizer.learnRate, self.minibatches.waited - waited, " *" if newBest else ""
+                ))
+            else:
+                print('\t e:{} | train loss: {:,.3f} | learn rate: {:,.2f} | data wait: {:,.2f}s'.format(
+                    e, trainingLoss.item(), optimizer.learnRate, self.minibatches.waited - waited
+                ))
+
+            if patience and self.sinceBest >= patience:
+                print('\t no improvement in {} epochs -- stop --.'.format(patience))
+                self.prune(reason='patience')
+
+            if checkpointDir and not e % checkpointEvery:
+                _dump(os.path.join(checkpointDir, 'progress-{}.ckpt'.format(self.index)), self.state())
+
+    def validate(self):
+        """Evaluate the model on the validation set (or its subsample), in chunks.
+
+        :return: an evaluation.Evaluation.
+        """
+        net, x, y = self.net, self.x, self.y
+        validation = evaluation.Evaluation()
+
+        for x.data, labels in dataset.chunks(self.validationSet, self.validationChunk, self.validationIndices):
+            y.data = dataset.oneHot(labels)
+            loss = net(x)
 
             # Prediction is output of antepenultimate layer,
             # because last layer is loss node during training:
-            prediction = net.layers[-2].data
-            prediction = np.argmax(prediction, axis=1)
-            validationAccuracy = np.mean(prediction == validationTarget) * 100
-            stats[e] = (trainingLoss.item(), validationLoss.item(), validationAccuracy)
-
-            # Keep best model so far:
-            newBest = False
-            if not len(bestQueue) or bestQueue[-1][2] < validationAccuracy:
-                bestModel = deepcopy(net)
-                bestModel.topology.pop()
-                best = (key, e, validationAccuracy, bestModel)
-                bestQueue.append(best)
-                newBest = True
-
-            print('\t e:{} | train loss: {:,.3f} | val loss: {:,.3f} | val accuracy: {:,.2f}% | learn rate: {:,.2f} {}'.format(
-                e, *stats[e], optimizer.learnRate, " *" if newBest else ""
-            ))
+            validation.add(net.layers[-2].data, labels, loss.item())
 
-    return allStats, bestQueue
+        return validation
+
+    def snapshot(self):
+        """Copy the model, without its loss node.
+
+        Only weight arrays are copied. Everything else (op classes, other arguments) is shared with the trained model.
+
+        :return: a nn.FFN.
+        """
+        return nn.FFN(*_topology(_weights(self.net.topology[:-1])))
+
+    def state(self):
+        """Get everything needed to resume training exactly where it is.
+
+        :return: a dictionary of weights, optimizer state, random state, epoch, stats and snapshots.
+        The random state is that of numpy's global generator when called in the middle of train.
+        """
+        return {
+            'weights': [np.copy(p.data) for p in self.net.vars if p is not self.y],
+            'momentum': [np.copy(m) for m in self.optimizer.m],
+            'random': np.random.get_state() if self._training else self.rngState,
+            'idx': np.copy(self.minibatches.idx),
+            'key': self.key, 'epoch': self.epoch, 'stopped': self.stopped, 'sinceBest': self.sinceBest,
+            'stats': dict(self.stats),
+            'best': [(key, e, accuracy, _weights(model.topology)) for key, e, accuracy, model in self.best]
+        }
+
+    def restore(self, state):
+        """Resume from a state returned by state().
+
+        :raises ValueError: if the state belongs to a different model.
+        """
+        if state.get('key', self.key) != self.key:
+            raise ValueError('state of {} can\'t resume {}.'.format(state['key'], self.key))
+
+        for p, w in zip([p for p in self.net.vars if p is not self.y], state['weights']):
+            p.data = w
+
+        self.optimizer.m = state['momentum']
+        self.rngState = state['random']
+        self.minibatches.idx[:] = state['idx']
+        self.epoch, self.stopped, self.sinceBest = state['epoch'], state['stopped'], state['sinceBest']
+        self.stats = state['stats']
+        self.best.clear()
+        self.best.extend(_snapshots(state['best']))
+
+    def prune(self, **decision):
+        """Stop training the model and record why in its stats.
+
+        :param decision: arbitrary entries describing the decision (i.e.: reason='patience').
+        """
+        self.stopped = True
+        self.stats['pruned'] = dict(epoch=self.epoch, **decision)
+
+        if self.statsLog:
+            self.statsLog.append(self.key, pruned=self.stats['pruned'])
+
+
+def benchmarkTrainer(layers, batchSize, trainingSet, seed=0, learnRate=0.1, **kwargs):
+    """Create a quiet trainer to time training steps with (see timeSteps).
+
+    :param layers, batchSize: the model's hidden layers and minibatch size.
+
+    :param trainingSet: see trainMNIST.
+
+    :param seed: seed for the model's initial weights and minibatch order.
+
+    :param learnRate: a fixed learn rate.
+
+    :param kwargs: other Trainer arguments, i.e.: prefetch or augmentation.
+
+    :return: a Trainer.
+    """
+    trainer = Trainer(
+        0, (layers, batchSize, (str(learnRate), lambda epochs, e: learnRate)), trainingSet, trainingSet, 1, 1, seed,
+        verbose=False, **kwargs
+    )
+    trainer.optimizer.learnRate = learnRate
+    return trainer
+
+
+def timeSteps(trainer, steps, replicas=None, warmup=1):
+    """Time training steps (forward and backward passes and an optimizer step) on a trainer's minibatches.
+
+    :param trainer: a Trainer (see benchmarkTrainer). Minibatches run over as many epochs as steps take.
+
+    :param steps: how many steps to time.
+
+    :param replicas: an optional parallel.DataParallel to compute gradients with.
+
+    :param warmup: how many untimed steps to take first.
+
+    :return: the time in seconds the timed steps took.
+    """
+    net, x, y, optimizer = trainer.net, trainer.x, trainer.y, trainer.optimizer
+    batches = chain.from_iterable(repeat(trainer.minibatches))
+
+    for step in range(warmup + steps):
+        if step == warmup:
+            t = time.perf_counter()
+
+        if replicas:
+            replicas.forwardBackward(*next(batches))
+            replicas.allReduce()
+        else:
+            x.data, y.data = next(batches)
+            net(x)
+            net.back()
+
+        optimizer.step()
+
+    return time.perf_counter() - t
+
+
+def mergeBest(bestQueue, best):
+    """Merge the snapshots of one model into the queue of best models.
+
+    A snapshot is kept if it beats the last model in the queue. Merging models in the order they were
+    defined in the search reproduces the queue of a serial run, regardless of which process trained them.
+
+    :param bestQueue: a deque of (key, epoch, valAccuracy, model) tuples, with a maximum length of keepBest.
+    :param best: the snapshots of one model (see Trainer.best).
+    """
+    for stat in best:
+        if not len(bestQueue) or bestQueue[-1][2] < stat[2]:
+            bestQueue.append(stat)
+
+
+def _initWorker(trainingSet, validationSet, combinations, trainerArgs, trainArgs):
+    # Workers are forked, so arguments arrive here without being pickled and the
+    # dataset pages are shared with the parent. Make sure they are only read:
+    for s in trainingSet, validationSet:
+        for a in s:
+            if isinstance(a, np.ndarray):
+                a.setflags(write=False)
+
+    _worker.update(
+        trainingSet=trainingSet, validationSet=validationSet, combinations=combinations,
+        trainerArgs=trainerArgs, trainArgs=trainArgs
+    )
+
+
+def _trainWorker(i):
+    w = _worker
+    return trainCombination(
+        i, w['combinations'][i], w['trainingSet'], w['validationSet'], w['trainerArgs'], w['trainArgs']
+    )
+
+
+def _key(epochs, combination):
+    layers, batchSize, learnRate = combination
+    return str((epochs, layers, batchSize, learnRate[0]))
+
+
+def _weights(topology):
+    # A topology with copies of its weight arrays in place of NetVars, cheap to pickle:
+    return [
+        (n[0], *[np.copy(p.data) if type(p) is nn.NetVar else p for p in n[1:]])
+        for n in topology
+    ]
+
+
+def _topology(weights):
+    return [
+        (n[0], *[nn.NetVar(p) if type(p) is np.ndarray else p for p in n[1:]])
+        for n in weights
+    ]
+
+
+def _snapshots(best):
+    return [(key, e, accuracy, nn.FFN(*_topology(weights))) for key, e, accuracy, weights in best]
+
+
+def _dump(path, obj):
+    # Write then rename, so an interruption never leaves a partial checkpoint:
+    with open(path + '.tmp', 'wb') as file:
+        pickle.dump(obj, file, pickle.HIGHEST_PROTOCOL)
+
+    os.replace(path + '.tmp', path)
+
+
+def _load(path):
+    with open(path, 'rb') as file:
+        return pickle.load(file)